@@ -1,44 +1,399 @@
-from PiViewer import find_PiPi
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
 import os
+import signal
+import sys
+import time
 
+import numpy as np
 
-if __name__ == '__main__':
+if sys.version_info[0] < 3:
+    from PiViewer import find_PiPi_multi, find_PiPi_interactions, find_PiPi_ligands, sweep_PiPi, PiPiInteraction
+else:
+    from PiViewer_python3 import find_PiPi_multi, find_PiPi_interactions, find_PiPi_ligands, sweep_PiPi, \
+        PiPiInteraction
+from PDBReader import EXCLUDED_LIGANDS, LAYOUTS, structure_path
+from RingCache import RingCache
+from RunLedger import RunLedger, write_record
+from PiPiStats import PiPiStats
+from ResultWriter import open_writer
 
-    if False:   # test if single pdb works
-        # pdb_file = r'D:\Iridium_HT_deposited\1a28_d1refined.pdb'
-        pdb_file = r'C:\CloudStation\Epicat\Git\PiViewer\1ACJ.pdb'
-        lig_name = 'THA'
-        print find_PiPi(pdb_file, lig_name, 5.0, 25, 80, 0)
+try:
+    from multiprocessing import SimpleQueue
+except ImportError:  # Python 2
+    from multiprocessing.queues import SimpleQueue
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Layout of the results stored in a ledger, bumped when it changes so older records are recomputed.
+LEDGER_LAYOUT = 2
+
+
+class StructureTimeout(Exception):
+    pass
 
-    # Parse the list file containing PDB codes and ligand res names
-    pdb_list_file = r'.\Dataset\Iridium_HT_PDB_list.txt'
-    with open(pdb_list_file, 'r') as fin:
-        os.chdir('C:\CloudStation\Epicat\Git\PiViewer\Dataset\Iridium_HT_deposited')
 
+def _alarm_handler(signum, frame):
+    raise StructureTimeout()
+
+
+# Parse the list file containing PDB codes and ligand res names
+def parse_list_file(pdb_list_file):
+    '''
+    Each line holds a PDB code and a comma separated list of ligand residue names,
+    which may be left out when all the ligands are screened,
+    return a list of (pdb_code, lig_list).
+    '''
+    entries = []
+    with open(pdb_list_file, 'r') as fin:
         for line in fin:
             items = line.split()
+            if not items:
+                continue
             pdb_code = items[0]
-            lig_list = items[1].split(',')
-            print pdb_code,
-            # print lig_list,
-
-            # generate pdb file path
-            pdb_file = pdb_code.lower() + '_d1refined.pdb'
-
+            lig_list = items[1].split(',') if len(items) > 1 else []
             # in many cases the ligand res name is UNL instead of specified in the list
             lig_list.append('UNL')
+            entries.append((pdb_code, lig_list))
+    return entries
+
+
+# Sum up the per ligand counts the way the batch report expects.
+def summarize(lig_list, results):
+    '''
+    return the total number of Pi-Pi interactions over lig_list, -1 if none of the ligands is found.
+    In sweep mode the counts and the total are arrays over the criteria,
+    lists of interactions are counted by their length.
+    '''
+    total_found = 0
+    total_unfound = 0
+    for lig_name in lig_list:
+        count = results[lig_name]
+        if isinstance(count, list):
+            count = len(count)
+        if np.ndim(count) == 0 and count == -1:
+            total_unfound += 1
+        else:
+            total_found = total_found + count
+    if total_unfound == len(lig_list):
+        return -1
+    return total_found
+
+
+# Results of one structure as stored in a RunLedger, and back.
+def _encode_result(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def _decode_result(value, sweep):
+    if not isinstance(value, list):
+        return value
+    if sweep:
+        return np.array(value)
+    # The ring atoms are the only lists of an interaction.
+    return [PiPiInteraction(*[tuple(v) if isinstance(v, list) else v for v in row]) for row in value]
+
+
+def _encode_results(results, exclude):
+    '''
+    return results as a JSON compatible dict, the ligand instances of exclude mode are stored under '*'.
+    '''
+    if exclude is not None:
+        return {'*': [list(key) + [_encode_result(value)] for key, value in results.items()]}
+    return dict((lig_name, _encode_result(value)) for lig_name, value in results.items())
+
+
+def _decode_results(results, lig_list, sweep, exclude):
+    if exclude is not None:
+        return dict((tuple(row[:-1]), _decode_result(row[-1], sweep)) for row in results['*'])
+    return dict((lig_name, _decode_result(results[lig_name], sweep)) for lig_name in lig_list)
+
 
-            # detect Pi-Pi interactions
-            total_found = 0
-            total_unfound = 0
-            for lig_name in lig_list:
-                count = find_PiPi(pdb_file, lig_name, verbose=0)
-                if count > 0:
-                    total_found += count
-                elif count == -1:
-                    total_unfound += 1
-            if total_unfound == len(lig_list):
-                print -1
+# Pool workers report the task they start and their pid, so that the batch notices the death of a worker.
+_started_queue = None
+
+
+def _init_worker(queue):
+    global _started_queue
+    _started_queue = queue
+
+
+def _analyze_reported(index, task):
+    _started_queue.put((index, os.getpid()))
+    return _analyze(task)
+
+
+# Worker: detect Pi-Pi interactions of one structure, never raises.
+def _analyze(task):
+    pdb_code, pdb_file, lig_list, criteria, sweep, details, exclude, timeout, with_stats, started = task
+    if started is not None:
+        path, record = started
+        write_record(path, dict(record, pid=os.getpid()))
+    stats = PiPiStats(keep_calls=True) if with_stats else None
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _alarm_handler)
+        signal.alarm(int(max(1, round(timeout))))
+    try:
+        if sweep:
+            results = sweep_PiPi(pdb_file, lig_list, *sweep, pocket=criteria['pocket'], cache=criteria['cache'],
+                                 templates=criteria['templates'], stats=stats)
+        elif exclude is not None:
+            results = find_PiPi_ligands(pdb_file, verbose=0, exclude=exclude, details=details, stats=stats, **criteria)
+        elif details:
+            results = find_PiPi_interactions(pdb_file, lig_list, stats=stats, **criteria)
+        else:
+            results = find_PiPi_multi(pdb_file, lig_list, verbose=0, stats=stats, **criteria)
+        return pdb_code, results, None, stats and stats.to_dict()
+    except StructureTimeout:
+        return pdb_code, None, 'timeout', None
+    except Exception as e:
+        return pdb_code, None, '%s: %s' % (type(e).__name__, e), None
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+def batch_PiPi(pdb_list_file, structure_dir, workers=None, chunksize=64, timeout=None,
+               suffix='_d1refined.pdb', centroid_distance=5.0, dih_parallel=25, dih_tshape=80, pocket=False,
+               cache=None, sweep=None, details=False, exclude=None, templates=False, stats=None, ledger=None,
+               layouts=None):
+    """
+    Find Pi-Pi interactions for every structure of the list file over a process pool.
+    OpenBabel objects are never shared, each worker parses its own structures.
+    :param pdb_list_file: list file of PDB codes and ligand residue names.
+    :param structure_dir: directory holding the structure files.
+    :param workers: number of worker processes, defaults to the number of cores, 1 runs in process.
+    :param chunksize: number of structures submitted to the pool at a time.
+    :param timeout: max seconds spent on one structure, None for no limit.
+    :param suffix: appended to the lower case PDB code to build the file name, unless layouts are given.
+    :param pocket: perceive rings only in the residues near each ligand.
+    :param cache: RingCache shared by the workers to skip ring perception of already seen files.
+    :param sweep: (distances, parallels, tshapes) lists of criteria values to count every combination of,
+                  the results are then (D,P,T) arrays and the single criteria are ignored.
+    :param details: return the list of PiPiInteraction of each ligand instead of its count.
+    :param exclude: screen every ligand instance but the residue names of exclude instead of the listed names,
+                    the results are then keyed by (ligand name, chain, residue number, insertion code),
+                    not used in sweep mode.
+    :param templates: take the rings of standard residues from RingTemplates instead of OpenBabel.
+    :param stats: PiPiStats.PiPiStats the stats of every structure are merged into, in the list file order.
+    :param ledger: RunLedger.RunLedger recording every result, structures with the same content and criteria
+                   already in it are not analyzed again, those it quarantined are reported as 'quarantined'.
+    :param layouts: names of PDBReader.LAYOUTS or file name patterns tried in order to find the file of a PDB code,
+                    such as ['pdb', 'mmcif'] for a local PDB mirror, gzipped files are read directly.
+    :return: generator of (pdb_code, lig_list, results, error) in the list file order, results is a dict of
+             ligand name to count, error is None, 'timeout', 'crashed' (the worker died), 'quarantined'
+             or the exception text.
+    """
+    criteria = dict(centroid_distance=centroid_distance, dih_parallel=dih_parallel, dih_tshape=dih_tshape,
+                    pocket=pocket, cache=cache, templates=templates)
+    entries = parse_list_file(pdb_list_file)
+    if layouts is None:
+        layouts = ['{code}' + suffix]
+    tasks = [[pdb_code, structure_path(structure_dir, pdb_code, layouts), lig_list, criteria, sweep, details,
+              exclude, timeout, stats is not None, None] for pdb_code, lig_list in entries]
+
+    # Results already in the ledger, and the ledger key of the others.
+    known = {}
+    keys = {}
+    if ledger is not None:
+        signature = json.dumps(dict(centroid_distance=centroid_distance, dih_parallel=dih_parallel,
+                                    dih_tshape=dih_tshape, pocket=pocket, templates=templates, sweep=sweep,
+                                    details=details, exclude=sorted(exclude) if exclude is not None else None,
+                                    layout=LEDGER_LAYOUT),
+                               sort_keys=True)
+        for index, task in enumerate(tasks):
+            pdb_code, pdb_file, lig_list = task[:3]
+            if not os.path.exists(pdb_file):
+                continue
+            sha1 = ledger.digest(pdb_file)
+            recorded = ledger.results(sha1, signature, ['*'] if exclude is not None else lig_list)
+            if recorded is not None:
+                known[index] = (_decode_results(recorded, lig_list, sweep, exclude), None)
+            elif ledger.quarantined(sha1, signature):
+                known[index] = (None, 'quarantined')
             else:
-                print total_found
-    #
\ No newline at end of file
+                keys[index] = (sha1, signature, pdb_code, pdb_file)
+                task[-1] = (ledger.path, ledger.record('started', *keys[index]))
+
+    todo = [index for index in range(len(tasks)) if index not in known]
+    ran = _run_tasks(tasks, todo, workers, chunksize, timeout)
+    try:
+        for index, (pdb_code, lig_list) in enumerate(entries):
+            if index in known:
+                results, error = known[index]
+                yield pdb_code, lig_list, results, error
+                continue
+            pdb_code, results, error, task_stats = next(ran)
+            if task_stats is not None:
+                stats.merge(task_stats)
+            if index in keys:
+                if error is None:
+                    ledger.append('done', *keys[index], results=_encode_results(results, exclude))
+                else:
+                    ledger.append(error if error in ('timeout', 'crashed') else 'error', *keys[index], error=error)
+            yield pdb_code, lig_list, results, error
+    finally:
+        ran.close()
+
+
+# Run the tasks of the todo indices, yield their _analyze results in order.
+def _run_tasks(tasks, todo, workers, chunksize, timeout):
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1:
+        for index in todo:
+            yield _analyze(tasks[index])
+        return
+
+    # Keep at most chunksize tasks in flight and collect them in submission order.
+    # The pool replaces a worker killed by a crash (segfault, OOM killer) but its task never returns:
+    # the task waited for is 'crashed' once the worker that started it is gone.
+    # A worker stuck inside OpenBabel ignores the alarm, the pool is then restarted.
+    grace = 5.0
+    poll = 0.5
+    queue = SimpleQueue()
+    pool = multiprocessing.Pool(workers, _init_worker, (queue,))
+    pending = []
+    running = {}
+    next_task = 0
+    try:
+        while pending or next_task < len(todo):
+            while next_task < len(todo) and len(pending) < max(chunksize, workers):
+                index = todo[next_task]
+                pending.append((index, pool.apply_async(_analyze_reported, (index, tasks[index]))))
+                next_task += 1
+            index, async_result = pending.pop(0)
+            result = None
+            while result is None:
+                try:
+                    result = async_result.get(poll)
+                    break
+                except multiprocessing.TimeoutError:
+                    pass
+                while not queue.empty():
+                    i, pid = queue.get()
+                    running[i] = (pid, timer())
+                if index not in running:
+                    continue
+                pid, since = running[index]
+                if pid not in [child.pid for child in multiprocessing.active_children()]:
+                    try:
+                        # The worker may have died right after sending its result.
+                        result = async_result.get(poll)
+                    except multiprocessing.TimeoutError:
+                        result = tasks[index][0], None, 'crashed', None
+                elif timeout and timer() - since > timeout + grace:
+                    result = tasks[index][0], None, 'timeout', None
+                    pool.terminate()
+                    pool.join()
+                    queue = SimpleQueue()
+                    running = {}
+                    pool = multiprocessing.Pool(workers, _init_worker, (queue,))
+                    pending = [(i, pool.apply_async(_analyze_reported, (i, tasks[i]))) for i, _ in pending]
+            running.pop(index, None)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch detection of Pi-Pi interactions.')
+    parser.add_argument('list_file', help='list file of PDB codes and ligand residue names')
+    parser.add_argument('structure_dir', help='directory holding the structure files')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=64, help='structures submitted to the pool at a time')
+    parser.add_argument('--timeout', type=float, default=None, help='max seconds per structure')
+    parser.add_argument('--suffix', default='_d1refined.pdb', help='file name suffix after the PDB code')
+    parser.add_argument('--layout', default=None,
+                        help='comma separated file layouts tried in order instead of --suffix: %s, '
+                             'or patterns such as {mid}/pdb{code}.ent.gz' % ', '.join(sorted(LAYOUTS)))
+    parser.add_argument('--centroid-distance', type=float, default=5.0, help='Max ring centroid distance')
+    parser.add_argument('--dih-parallel', type=float, default=25, help='Max dihedral (parallel)')
+    parser.add_argument('--dih-tshape', type=float, default=80, help='Min dihedral (T-shaped)')
+    parser.add_argument('--pocket', action='store_true', help='perceive rings only in the residues near the ligand')
+    parser.add_argument('--templates', action='store_true',
+                        help='take the rings of standard residues from atom name templates, faster but not '
+                             'equivalent to OpenBabel (all HIS and TRP rings are aromatic)')
+    parser.add_argument('--cache-dir', default=None, help='directory of the persistent ring cache')
+    parser.add_argument('--cache-size', type=float, default=512, help='max size of the ring cache in MB')
+    parser.add_argument('--all-ligands', action='store_true',
+                        help='screen every ligand instance instead of the listed ligand names')
+    parser.add_argument('--exclude', default='',
+                        help='comma separated residue names skipped by --all-ligands on top of waters, ions and buffers')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write every interaction to a .csv, .jsonl or .parquet (needs pyarrow) file')
+    parser.add_argument('--ledger', default=None,
+                        help='JSON lines file of the results, a rerun only analyzes new or changed structures')
+    parser.add_argument('--max-attempts', type=int, default=2,
+                        help='timeouts or crashes of a structure before the ledger quarantines it')
+    parser.add_argument('--stats', default=None,
+                        help='write the stage times and counts of the run to a .json or Prometheus .prom file')
+    parser.add_argument('--sweep-distance', default=None, help='comma separated centroid distances to sweep')
+    parser.add_argument('--sweep-parallel', default=None, help='comma separated parallel dihedrals to sweep')
+    parser.add_argument('--sweep-tshape', default=None, help='comma separated T-shaped dihedrals to sweep')
+    args = parser.parse_args(argv)
+    cache = RingCache(args.cache_dir, int(args.cache_size * 1024 * 1024)) if args.cache_dir else None
+    sweep = None
+    if args.sweep_distance or args.sweep_parallel or args.sweep_tshape:
+        if args.all_ligands:
+            parser.error('--all-ligands cannot be combined with the --sweep options')
+        if args.output:
+            parser.error('-o cannot be combined with the --sweep options')
+        sweep = tuple([float(v) for v in values.split(',')] if values else [default] for values, default in (
+            (args.sweep_distance, args.centroid_distance), (args.sweep_parallel, args.dih_parallel),
+            (args.sweep_tshape, args.dih_tshape)))
+        total = np.zeros([len(values) for values in sweep], dtype=int)
+        hit = np.zeros_like(total)
+    exclude = None
+    if args.all_ligands:
+        exclude = EXCLUDED_LIGANDS | set(name for name in args.exclude.split(',') if name)
+    stats = PiPiStats() if args.stats else None
+    ledger = RunLedger(args.ledger, args.max_attempts) if args.ledger else None
+    writer = None
+    if args.output:
+        writer = open_writer(args.output, ('pdb_code',) + PiPiInteraction._fields)
+
+    for pdb_code, lig_list, results, error in batch_PiPi(
+            args.list_file, args.structure_dir, args.workers, args.chunksize, args.timeout, args.suffix,
+            args.centroid_distance, args.dih_parallel, args.dih_tshape, args.pocket, cache, sweep, writer is not None,
+            exclude, args.templates, stats, ledger, args.layout.split(',') if args.layout else None):
+        if exclude is not None and not error:
+            lig_list = list(results)
+        if writer is not None and not error:
+            for interactions in results.values():
+                if interactions != -1:
+                    writer.write((pdb_code,) + interaction for interaction in interactions)
+        if error:
+            print(pdb_code, error)
+        elif sweep:
+            counts = summarize(lig_list, results)
+            if np.ndim(counts):
+                total += counts
+                hit += counts > 0
+        else:
+            print(pdb_code, summarize(lig_list, results))
+        sys.stdout.flush()
+    if writer is not None:
+        writer.close()
+    if stats is not None:
+        with open(args.stats, 'w') as fout:
+            fout.write(stats.to_prometheus() if args.stats.endswith('.prom') else stats.to_json(indent=1))
+
+    # Totals of the sweep: one line per combination of the criteria.
+    if sweep:
+        print('distance\tparallel\ttshape\tinteractions\tstructures')
+        for (i, j, k), count in np.ndenumerate(total):
+            print('%g\t%g\t%g\t%d\t%d' % (sweep[0][i], sweep[1][j], sweep[2][k], count, hit[i, j, k]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+if sys.version_info[0] < 3:
+    from PiViewer import ob, find_PiPi_multi
+else:
+    from PiViewer_python3 import ob, find_PiPi_multi
+from BatchAnalysis import parse_list_file, batch_PiPi
+from PiPiStats import PiPiStats, STAGES
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def peak_rss(children=False):
+    '''
+    return the peak resident set size in kB of this process (or of its largest child), None if unknown.
+    '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kB elsewhere.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def time_structure(pdb_file, lig_names, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, templates=False):
+    '''
+    Run find_PiPi_multi with a PiPiStats,
+    return the dict of ligand name to count (-1 if not found) and the dict of stage durations in seconds.
+    '''
+    stats = PiPiStats()
+    counts = find_PiPi_multi(pdb_file, lig_names, centroid_distance, dih_parallel, dih_tshape, verbose=0,
+                             templates=templates, stats=stats)
+    return counts, stats.times
+
+
+def run_benchmark(pdb_file='1ACJ.pdb', lig_name='THA', list_file='Dataset/Iridium_HT_PDB_list.txt',
+                  structure_dir='Dataset/Iridium_HT_deposited', suffix='_d1refined.pdb', repeat=5, workers=(1,),
+                  templates=False):
+    """
+    Time find_PiPi on a single structure and on a dataset.
+    :param pdb_file: single structure, run repeat times.
+    :param lig_name: ligand residue name of pdb_file.
+    :param list_file: list file of PDB codes and ligand residue names of the dataset.
+    :param structure_dir: directory holding the structure files of the dataset.
+    :param suffix: appended to the lower case PDB code to build the file name.
+    :param repeat: number of runs on pdb_file, the best and median are reported.
+    :param workers: worker counts of the BatchAnalysis throughput runs, 0 skips them.
+    :param templates: take the rings of standard residues from RingTemplates.
+    :return: dict of the results, see the README.
+    """
+    report = {'python': platform.python_version(), 'openbabel': ob.OBReleaseVersion(), 'numpy': np.__version__,
+              'platform': platform.platform(), 'cpus': multiprocessing.cpu_count(),
+              'options': {'repeat': repeat, 'workers': list(workers), 'templates': templates}}
+
+    runs = []
+    for _ in range(repeat):
+        t0 = timer()
+        counts, stages = time_structure(pdb_file, [lig_name], templates=templates)
+        runs.append((timer() - t0, stages))
+    walls = sorted(wall for wall, _ in runs)
+    report['single'] = {'file': os.path.basename(pdb_file), 'wall_best': walls[0],
+                        'wall_median': walls[len(walls) // 2], 'stages': min(runs, key=lambda run: run[0])[1],
+                        'counts': counts}
+
+    entries = parse_list_file(list_file)
+    totals = dict((stage, 0.0) for stage in STAGES)
+    allCounts = {}
+    t0 = timer()
+    for pdb_code, lig_list in entries:
+        counts, stages = time_structure(os.path.join(structure_dir, pdb_code.lower() + suffix), lig_list,
+                                        templates=templates)
+        allCounts[pdb_code] = counts
+        for stage in STAGES:
+            totals[stage] += stages[stage]
+    wall = timer() - t0
+    report['dataset'] = {'structures': len(entries), 'wall': wall, 'structures_per_s': len(entries) / wall,
+                         'stages': totals, 'peak_rss_kb': peak_rss()}
+    report['counts'] = allCounts
+
+    report['throughput'] = {}
+    for n in workers:
+        if n <= 0:
+            continue
+        t0 = timer()
+        mismatches = 0
+        for pdb_code, lig_list, results, error in batch_PiPi(list_file, structure_dir, workers=n, suffix=suffix,
+                                                             templates=templates):
+            if error or results != allCounts[pdb_code]:
+                mismatches += 1
+        wall = timer() - t0
+        report['throughput'][str(n)] = {'wall': wall, 'structures_per_s': len(entries) / wall,
+                                        'peak_rss_kb': peak_rss(children=n > 1), 'mismatches': mismatches}
+    return report
+
+
+def compare(report, baseline, tolerance=0.2):
+    '''
+    return the list of differences of report from baseline: changed counts,
+    and times or throughputs worse than the baseline by more than tolerance (a fraction).
+    '''
+    problems = []
+    for pdb_code, counts in sorted(baseline.get('counts', {}).items()):
+        if report['counts'].get(pdb_code) != counts:
+            problems.append('counts of %s: %s, baseline %s' % (pdb_code, report['counts'].get(pdb_code), counts))
+    if baseline.get('single', {}).get('counts') not in (None, report['single']['counts']):
+        problems.append('counts of %s: %s, baseline %s' % (report['single']['file'], report['single']['counts'],
+                                                           baseline['single']['counts']))
+    times = [('single wall_best', report['single']['wall_best'], baseline.get('single', {}).get('wall_best')),
+             ('dataset wall', report['dataset']['wall'], baseline.get('dataset', {}).get('wall'))]
+    times += [('dataset %s' % stage, report['dataset']['stages'][stage],
+               baseline.get('dataset', {}).get('stages', {}).get(stage)) for stage in STAGES]
+    for label, value, base in times:
+        if base and value > base * (1 + tolerance):
+            problems.append('%s: %.3f s, baseline %.3f s (+%.0f%%)' % (label, value, base, 100 * (value / base - 1)))
+    for n, run in sorted(report['throughput'].items()):
+        base = baseline.get('throughput', {}).get(n, {}).get('structures_per_s')
+        if run['mismatches']:
+            problems.append('%s workers: %d structures with other counts or errors' % (n, run['mismatches']))
+        if base and run['structures_per_s'] < base * (1 - tolerance):
+            problems.append('%s workers: %.1f structures/s, baseline %.1f' % (n, run['structures_per_s'], base))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the Pi-Pi detection on 1ACJ and the dataset.')
+    parser.add_argument('--pdb-file', default='1ACJ.pdb', help='single structure timed repeatedly')
+    parser.add_argument('--ligand', default='THA', help='ligand residue name of the single structure')
+    parser.add_argument('--list', default=os.path.join('Dataset', 'Iridium_HT_PDB_list.txt'),
+                        help='list file of the dataset')
+    parser.add_argument('--structure-dir', default=os.path.join('Dataset', 'Iridium_HT_deposited'),
+                        help='directory holding the structure files of the dataset')
+    parser.add_argument('--suffix', default='_d1refined.pdb', help='file name suffix after the PDB code')
+    parser.add_argument('--repeat', type=int, default=5, help='runs on the single structure')
+    parser.add_argument('-j', '--workers', default='1', help='comma separated worker counts of the throughput runs')
+    parser.add_argument('--templates', action='store_true',
+                        help='take the rings of standard residues from atom name templates, faster but not '
+                             'equivalent to OpenBabel (all HIS and TRP rings are aromatic)')
+    parser.add_argument('-o', '--output', default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown over the baseline, 0.2 = 20%%')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.pdb_file, args.ligand, args.list, args.structure_dir, args.suffix, args.repeat,
+                           [int(n) for n in args.workers.split(',')], args.templates)
+    single = report['single']
+    print('%s: best %.3f s, median %.3f s, counts %s' % (single['file'], single['wall_best'], single['wall_median'],
+                                                         single['counts']))
+    print('  ' + '  '.join('%s %.3f s' % (stage, single['stages'][stage]) for stage in STAGES))
+    dataset = report['dataset']
+    print('Dataset: %d structures in %.2f s (%.1f structures/s), peak RSS %s kB' % (
+        dataset['structures'], dataset['wall'], dataset['structures_per_s'], dataset['peak_rss_kb']))
+    print('  ' + '  '.join('%s %.2f s' % (stage, dataset['stages'][stage]) for stage in STAGES))
+    for n, run in sorted(report['throughput'].items(), key=lambda item: int(item[0])):
+        print('%s workers: %.2f s (%.1f structures/s), peak RSS %s kB' % (n, run['wall'], run['structures_per_s'],
+                                                                          run['peak_rss_kb']))
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(report, fout, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fin:
+            problems = compare(report, json.load(fin), args.tolerance)
+        for problem in problems:
+            print('REGRESSION', problem)
+        print('%d differences from %s' % (len(problems), args.baseline))
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
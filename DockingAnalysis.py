@@ -0,0 +1,76 @@
+from __future__ import print_function
+import argparse
+import os
+import sys
+
+import numpy as np
+
+if sys.version_info[0] < 3:
+    from PiViewer import pybel, file_rings, perceive_rings, pair_geometry, pipi_mask
+else:
+    from PiViewer_python3 import pybel, file_rings, perceive_rings, pair_geometry, pipi_mask
+import PDBReader
+from RingCache import RingCache
+
+# OpenBabel format of the pose files by extension.
+POSE_FORMATS = {'.sdf': 'sdf', '.sd': 'sdf', '.mol2': 'mol2', '.pdb': 'pdb', '.ent': 'pdb', '.pdbqt': 'pdbqt'}
+
+
+def pose_format(pose_file):
+    '''
+    return the OpenBabel format of the pose file from its extension.
+    '''
+    ext = os.path.splitext(pose_file)[1].lower()
+    if ext not in POSE_FORMATS:
+        raise ValueError('Unknown pose file format: %s' % pose_file)
+    return POSE_FORMATS[ext]
+
+
+def score_poses(receptor_file, pose_file, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, fmt=None,
+                cache=None, templates=False):
+    """
+    Find Pi-Pi interactions of every ligand pose against one receptor.
+    The receptor rings are perceived once, the poses are streamed from the file one at a time.
+    :param receptor_file: path of the receptor in PDB or mmCIF format.
+    :param pose_file: multi-molecule SDF, MOL2 or multi-MODEL PDB file of the poses.
+    :param centroid_distance: Max ring centroid distance
+    :param dih_parallel: Max dihedral (parallel)
+    :param dih_tshape: Min dihedral (T-shaped)
+    :param fmt: OpenBabel format of the pose file, guessed from its extension if None.
+    :param cache: RingCache.RingCache for the receptor rings.
+    :param templates: take the rings of standard residues from RingTemplates instead of OpenBabel.
+    :return: generator of (pose index, pose title, number of Pi-Pi interactions found)
+    """
+    rings = file_rings(receptor_file, PDBReader.read_structure(receptor_file), cache, templates)
+    recCenters = rings.centers[rings.aromatic]
+    recNormals = rings.normals[rings.aromatic]
+    for index, pose in enumerate(pybel.readfile(fmt or pose_format(pose_file), pose_file)):
+        ligRings = perceive_rings(pose)
+        dist, angle = pair_geometry(ligRings.centers[ligRings.aromatic], ligRings.normals[ligRings.aromatic],
+                                    recCenters, recNormals)
+        yield index, pose.title, int(np.count_nonzero(pipi_mask(dist, angle, centroid_distance, dih_parallel,
+                                                                 dih_tshape)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pi-Pi interactions of docking poses against one receptor.')
+    parser.add_argument('receptor', help='receptor file in PDB or mmCIF format')
+    parser.add_argument('poses', help='SDF, MOL2 or multi-MODEL PDB file of the ligand poses')
+    parser.add_argument('--format', default=None, help='OpenBabel format of the pose file')
+    parser.add_argument('--centroid-distance', type=float, default=5.0, help='Max ring centroid distance')
+    parser.add_argument('--dih-parallel', type=float, default=25, help='Max dihedral (parallel)')
+    parser.add_argument('--dih-tshape', type=float, default=80, help='Min dihedral (T-shaped)')
+    parser.add_argument('--templates', action='store_true',
+                        help='take the rings of standard residues from atom name templates, faster but not '
+                             'equivalent to OpenBabel (all HIS and TRP rings are aromatic)')
+    parser.add_argument('--cache-dir', default=None, help='directory of the persistent ring cache')
+    args = parser.parse_args(argv)
+    cache = RingCache(args.cache_dir) if args.cache_dir else None
+
+    for index, title, count in score_poses(args.receptor, args.poses, args.centroid_distance, args.dih_parallel,
+                                           args.dih_tshape, args.format, cache, args.templates):
+        print('%d\t%s\t%d' % (index + 1, title, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+from __future__ import print_function
+import argparse
+import sys
+
+if sys.version_info[0] < 3:
+    from PiViewer import find_PiPi_network, PiPiContact
+else:
+    from PiViewer_python3 import find_PiPi_network, PiPiContact
+from ResultWriter import open_writer
+
+
+def stacking_clusters(contacts):
+    '''
+    contacts is a list of PiPiContact,
+    return the connected residues of the network, a list of sets of (name, chain, resnum, icode), largest first.
+    '''
+    parent = {}
+
+    def root(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for contact in contacts:
+        nodes = [(contact.name1, contact.chain1, contact.resnum1, contact.icode1),
+                 (contact.name2, contact.chain2, contact.resnum2, contact.icode2)]
+        for node in nodes:
+            parent.setdefault(node, node)
+        parent[root(nodes[0])] = root(nodes[1])
+    clusters = {}
+    for node in parent:
+        clusters.setdefault(root(node), set()).add(node)
+    return sorted(clusters.values(), key=lambda cluster: (-len(cluster), sorted(cluster)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pi-Pi stacking network between all the rings of structures.')
+    parser.add_argument('files', nargs='+', help='structure files in PDB or mmCIF format')
+    parser.add_argument('--centroid-distance', type=float, default=5.0, help='Max ring centroid distance')
+    parser.add_argument('--dih-parallel', type=float, default=25, help='Max dihedral (parallel)')
+    parser.add_argument('--dih-tshape', type=float, default=80, help='Min dihedral (T-shaped)')
+    parser.add_argument('--between-chains', action='store_true', help='only report the pairs of rings of two chains')
+    parser.add_argument('--templates', action='store_true',
+                        help='take the rings of standard residues from atom name templates, faster but not '
+                             'equivalent to OpenBabel (all HIS and TRP rings are aromatic)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the edge list to a .csv, .jsonl or .parquet (needs pyarrow) file')
+    args = parser.parse_args(argv)
+
+    writer = open_writer(args.output, ('file',) + PiPiContact._fields) if args.output else None
+    for pdb_file in args.files:
+        contacts = find_PiPi_network(pdb_file, args.centroid_distance, args.dih_parallel, args.dih_tshape,
+                                     args.between_chains, templates=args.templates)
+        if writer is not None:
+            writer.write((pdb_file,) + contact for contact in contacts)
+        print("%s: %d Pi-Pi contacts" % (pdb_file, len(contacts)))
+        for contact in contacts:
+            print("  %s %s%s%s ring %d -- %s %s%s%s ring %d  Angle(deg.): %5.2f  Distance(A): %.2f  %s" % (
+                contact.name1, contact.chain1, contact.resnum1, contact.icode1, contact.ring_id1, contact.name2,
+                contact.chain2, contact.resnum2, contact.icode2, contact.ring_id2, contact.angle, contact.distance,
+                contact.type))
+        for cluster in stacking_clusters(contacts):
+            if len(cluster) > 2:
+                print("  Network of %d residues: %s" % (len(cluster), ' '.join(
+                    '%s %s%s%s' % residue for residue in sorted(cluster, key=lambda residue: residue[1:]))))
+    if writer is not None:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight PDB/mmCIF reader for PiViewer.
+Atoms of the first model are indexed by residue into NumPy arrays without building an OBMol,
+so that missing ligands are answered at once and OpenBabel only gets the atoms it needs.
+Gzipped files are decompressed while they are read, and PDB codes are mapped to the files of
+flat directories or of local PDB mirrors through layouts.
+"""
+
+import gzip
+import os
+import re
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+# Residue names of solvent water, never part of a ring.
+WATER_NAMES = frozenset(['HOH', 'WAT', 'DOD', 'H2O', 'SOL', 'TIP', 'TIP3'])
+
+# Residues of protein and nucleic acid chains, including common modified ones, never taken as ligands.
+POLYMER_RESIDUES = frozenset([
+    'ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE', 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER',
+    'THR', 'TRP', 'TYR', 'VAL', 'ASX', 'GLX', 'SEC', 'PYL', 'UNK', 'HID', 'HIE', 'HIP', 'HSD', 'HSE', 'HSP', 'CYX',
+    'ACE', 'NME', 'NH2', 'MSE', 'SEP', 'TPO', 'PTR', 'CME', 'CSO', 'CSD', 'KCX', 'LLP', 'MLY', 'HYP', 'PCA',
+    'A', 'C', 'G', 'U', 'I', 'T', 'DA', 'DC', 'DG', 'DT', 'DU', 'DI'])
+
+# Default residue names skipped when discovering ligands: waters, ions and common buffer or cryo components.
+EXCLUDED_LIGANDS = frozenset(WATER_NAMES | set([
+    'NA', 'K', 'LI', 'RB', 'CS', 'MG', 'CA', 'SR', 'BA', 'MN', 'FE', 'FE2', 'CO', 'NI', 'CU', 'CU1', 'ZN', 'CD',
+    'HG', 'PT', 'AU', 'AG', 'PB', 'AL', 'GA', 'YB', 'SM', 'CL', 'BR', 'IOD', 'F', 'OH', 'NH4', 'CAC', 'AZI', 'CYN',
+    'SO4', 'PO4', 'PI', 'NO3', 'SCN', 'CO3', 'BCT', 'GOL', 'EDO', 'PEG', 'PGE', 'PG4', '1PE', 'P6G', 'MPD', 'DMS',
+    'ACT', 'ACY', 'FMT', 'CIT', 'FLC', 'TRS', 'EPE', 'MES', 'BME', 'DTT', 'IMD', 'IPA', 'EOH', 'MOH', 'BU3',
+    'TAR', 'MLI', 'SIN', 'NHE', 'CXS']))
+
+# Atoms of the first model. records holds the PDB atom lines handed to OpenBabel,
+# residue i owns the atoms res_starts[i]:res_starts[i + 1], res_index maps a residue name to its residues.
+Structure = namedtuple('Structure', ['records', 'serials', 'names', 'resnames', 'chains', 'resnums', 'icodes',
+                                     'elements', 'hetatm', 'coords', 'res_starts', 'atom_res', 'res_index',
+                                     'conect'])
+
+# File name patterns of a PDB code relative to a structure directory: {code} and {CODE} are the lower and
+# upper case code, {mid} its middle two characters, the subdirectory of the divided layout of PDB mirrors.
+LAYOUTS = {
+    'flat': '{code}_d1refined.pdb',
+    'pdb': '{mid}/pdb{code}.ent.gz',
+    'mmcif': '{mid}/{code}.cif.gz',
+}
+
+_PDB_ATOM_FORMAT = '%-6s%5d %-4s%1s%3s %1s%4d%1s   %8.3f%8.3f%8.3f%6.2f%6.2f          %2s%2s'
+_CIF_TOKEN = re.compile(r"'(.*?)'(?=\s|$)|\"(.*?)\"(?=\s|$)|(\S+)")
+
+
+def _hy36decode(width, field):
+    '''
+    return the value of a PDB number field of the given width, decimal or hybrid-36 as written for more than
+    99999 atoms or 9999 residues, None if it is neither (such as the ***** of overflowed serials).
+    '''
+    field = field.strip()
+    try:
+        return int(field)
+    except ValueError:
+        pass
+    if len(field) != width or not field.isalnum():
+        return None
+    if field.isupper():
+        return int(field, 36) - 10 * 36 ** (width - 1) + 10 ** width
+    if field.islower():
+        return int(field, 36) + 16 * 36 ** (width - 1) + 10 ** width
+    return None
+
+
+def _build(records, serials, names, resnames, chains, resnums, icodes, elements, hetatm, coords, conect):
+    # Consecutive atoms with the same residue name, chain, number and insertion code form a residue.
+    n = len(records)
+    res_starts = [0] if n else []
+    for i in range(1, n):
+        if (resnums[i] != resnums[i - 1] or chains[i] != chains[i - 1] or icodes[i] != icodes[i - 1]
+                or resnames[i] != resnames[i - 1]):
+            res_starts.append(i)
+    res_starts.append(n)
+    res_starts = np.array(res_starts, dtype=int)
+    atom_res = np.repeat(np.arange(len(res_starts) - 1), np.diff(res_starts))
+    res_index = {}
+    for i, start in enumerate(res_starts[:-1]):
+        res_index.setdefault(resnames[start], []).append(i)
+    return Structure(records, np.array(serials, dtype=int), names, resnames, chains, np.array(resnums, dtype=int),
+                     icodes, elements, np.array(hetatm, dtype=bool), np.array(coords, dtype=float).reshape(-1, 3),
+                     res_starts, atom_res, res_index, conect)
+
+
+def read_pdb(lines):
+    '''
+    lines is an iterable of the lines of a PDB file,
+    return a Structure of the ATOM/HETATM records of its first model.
+    '''
+    records, serials, names, resnames, chains, resnums, icodes, elements, hetatm, coords = ([] for _ in range(10))
+    conect = []
+    for line in lines:
+        tag = line[:6]
+        if tag == 'ATOM  ' or tag == 'HETATM':
+            line = line.rstrip('\r\n')
+            # Overflowed or unreadable numbers fall back to the atom index and to the previous residue number.
+            serial = _hy36decode(5, line[6:11])
+            resnum = _hy36decode(4, line[22:26])
+            records.append(line)
+            serials.append(serial if serial is not None else len(serials) + 1)
+            names.append(line[12:16].strip())
+            resnames.append(line[17:20].strip())
+            chains.append(line[21:22])
+            resnums.append(resnum if resnum is not None else resnums[-1] if resnums else 0)
+            icodes.append(line[26:27])
+            elements.append(line[76:78].strip())
+            hetatm.append(tag == 'HETATM')
+            coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+        elif tag == 'CONECT':
+            line = line.rstrip('\r\n')
+            conect.append((line, [_hy36decode(5, line[i:i + 5]) for i in range(6, min(len(line), 31), 5)
+                                  if line[i:i + 5].strip()]))
+        elif tag == 'ENDMDL':
+            break
+    return _build(records, serials, names, resnames, chains, resnums, icodes, elements, hetatm, coords, conect)
+
+
+def iter_pdb_frames(lines):
+    '''
+    lines is an iterable of the lines of a PDB file,
+    return a generator of the (N,3) ATOM/HETATM coordinates of each MODEL, one model in memory at a time.
+    '''
+    coords = []
+    for line in lines:
+        tag = line[:6]
+        if tag == 'ATOM  ' or tag == 'HETATM':
+            coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+        elif tag == 'ENDMDL' and coords:
+            yield np.array(coords, dtype=float)
+            coords = []
+    if coords:
+        yield np.array(coords, dtype=float)
+
+
+def read_mmcif(lines):
+    '''
+    lines is an iterable of the lines of an mmCIF file,
+    return a Structure of the _atom_site records of its first model, written as PDB atom lines.
+    '''
+    columns = []
+    records, serials, names, resnames, chains, resnums, icodes, elements, hetatm, coords = ([] for _ in range(10))
+    model = None
+    in_loop = False
+    for line in lines:
+        if line.startswith('_atom_site.'):
+            columns.append(line.split('.', 1)[1].strip())
+            in_loop = True
+            continue
+        if not in_loop:
+            continue
+        if not columns or line.startswith(('loop_', '#', '_', 'data_')):
+            if records:
+                break
+            continue
+        values = [m.group(1) or m.group(2) or m.group(3) for m in _CIF_TOKEN.finditer(line)]
+        if len(values) != len(columns):
+            continue
+        row = dict(zip(columns, values))
+        if model is None:
+            model = row.get('pdbx_PDB_model_num')
+        elif row.get('pdbx_PDB_model_num') != model:
+            break
+        name = row.get('auth_atom_id', row.get('label_atom_id'))
+        resname = row.get('auth_comp_id', row.get('label_comp_id'))
+        chain = row.get('auth_asym_id', row.get('label_asym_id', ' '))
+        resnum = int(row.get('auth_seq_id', row.get('label_seq_id', '0')).replace('.', '0'))
+        icode = row.get('pdbx_PDB_ins_code', '?')
+        icode = ' ' if icode in ('?', '.') else icode[:1]
+        element = row.get('type_symbol', '')
+        altloc = row.get('label_alt_id', '.')
+        altloc = ' ' if altloc in ('?', '.') else altloc[:1]
+        charge = row.get('pdbx_formal_charge', '?')
+        charge = '' if charge in ('?', '.', '0') else '%s%s' % (charge.lstrip('+-'), '-' if charge.startswith('-') else '+')
+        serial = int(row.get('id', len(records) + 1))
+        xyz = (float(row['Cartn_x']), float(row['Cartn_y']), float(row['Cartn_z']))
+        tag = 'HETATM' if row.get('group_PDB') == 'HETATM' else 'ATOM'
+        # Atom names shorter than 4 start in column 14 unless the element has two letters.
+        field = name if len(name) >= 4 or len(element) == 2 else ' ' + name
+        # Large entries overflow the PDB columns, the Structure keeps the full chain ids and numbers.
+        records.append(_PDB_ATOM_FORMAT % (tag, serial % 100000, field, altloc, resname[:3], chain[:1], resnum % 10000,
+                                           icode, xyz[0], xyz[1], xyz[2], float(row.get('occupancy', 1.0)),
+                                           float(row.get('B_iso_or_equiv', 0.0)), element.upper(), charge))
+        serials.append(serial)
+        names.append(name)
+        resnames.append(resname)
+        chains.append(chain)
+        resnums.append(resnum)
+        icodes.append(icode)
+        elements.append(element)
+        hetatm.append(tag == 'HETATM')
+        coords.append(xyz)
+    return _build(records, serials, names, resnames, chains, resnums, icodes, elements, hetatm, coords, [])
+
+
+def open_text(path):
+    '''
+    Open the file at path for reading text lines, gzipped (.gz) files are decompressed on the fly.
+    '''
+    if path.lower().endswith('.gz'):
+        return gzip.open(path, 'rb' if sys.version_info[0] < 3 else 'rt')
+    return open(path, 'r')
+
+
+def is_mmcif(path):
+    '''
+    return True if the file name of path is an mmCIF one (.cif, .mmcif, optionally gzipped).
+    '''
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name.endswith(('.cif', '.mmcif'))
+
+
+def read_structure(path):
+    '''
+    Read a PDB or mmCIF (.cif, .mmcif) file, optionally gzipped, into a Structure.
+    '''
+    with open_text(path) as fin:
+        if is_mmcif(path):
+            return read_mmcif(fin)
+        return read_pdb(fin)
+
+
+def structure_path(structure_dir, pdb_code, layouts=('flat',)):
+    '''
+    layouts are names of LAYOUTS or file name patterns, tried in order,
+    return the path of the first existing file of pdb_code under structure_dir, or of the first layout if none exists.
+    '''
+    code = pdb_code.lower()
+    paths = [os.path.join(structure_dir, *LAYOUTS.get(layout, layout).format(
+        code=code, CODE=code.upper(), mid=code[1:3]).split('/')) for layout in layouts]
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return paths[0]
+
+
+def residue_atoms(structure, res):
+    '''
+    return the atom indices of residue res.
+    '''
+    return np.arange(structure.res_starts[res], structure.res_starts[res + 1])
+
+
+def pdb_block(structure, atoms):
+    '''
+    atoms are sorted atom indices,
+    return a PDB string of these atoms and of their CONECT records, ready for pybel.readstring.
+    Bonds to atoms left out are removed from the CONECT records, the other bonds of the atom are kept.
+    '''
+    lines = [structure.records[i] for i in atoms]
+    if structure.conect:
+        kept = set(structure.serials[atoms].tolist())
+        for line, serials in structure.conect:
+            if serials[0] not in kept:
+                continue
+            if kept.issuperset(serials):
+                lines.append(line)
+                continue
+            fields = [line[i:i + 5] for i in range(6, min(len(line), 31), 5) if line[i:i + 5].strip()]
+            partners = [field for field, serial in zip(fields[1:], serials[1:]) if serial in kept]
+            if partners:
+                lines.append('CONECT' + fields[0] + ''.join(partners))
+    lines.append('END')
+    return '\n'.join(lines) + '\n'
+
+
+def non_water_atoms(structure):
+    '''
+    return the indices of the atoms outside water residues.
+    '''
+    water = np.array([name in WATER_NAMES for name in structure.resnames], dtype=bool)
+    return np.nonzero(~water)[0]
+
+
+def ligand_residues(structure, exclude=EXCLUDED_LIGANDS):
+    '''
+    return the indices of the residues taken as ligands: neither polymer residues nor named in exclude.
+    '''
+    return [i for i, start in enumerate(structure.res_starts[:-1])
+            if structure.resnames[start] not in POLYMER_RESIDUES and structure.resnames[start] not in exclude]
@@ -0,0 +1,200 @@
+from __future__ import print_function
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+from collections import OrderedDict
+
+if sys.version_info[0] < 3:
+    from PiViewer import count_PiPi, list_PiPi, residue_rings
+    import SocketServer as socketserver
+else:
+    from PiViewer_python3 import count_PiPi, list_PiPi, residue_rings
+    import socketserver
+import PDBReader
+from PiPiStats import PiPiStats, recorded, timed
+from RingCache import MemoryRingCache
+
+
+class PiPiService(object):
+    """
+    Resident Pi-Pi detection: the parsed structures and their rings are kept in memory (the max_structures
+    most recently used files) so that repeated requests on the same receptor skip parsing and ring perception.
+    Requests and responses are JSON objects, see handle.
+    """
+
+    def __init__(self, max_structures=32):
+        self.max_structures = max_structures
+        self.rings = MemoryRingCache(max_structures)
+        self.stats = PiPiStats()
+        self.requests = 0
+        self.errors = 0
+        self._structures = OrderedDict()
+
+    def structure(self, path):
+        '''
+        return the PDBReader.Structure of the file at path, parsed again only if the file changed.
+        '''
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime)
+        structure = self._structures.pop(key, None)
+        if structure is None:
+            with timed(self.stats, 'parse'):
+                structure = PDBReader.read_structure(path)
+        self._structures[key] = structure
+        while len(self._structures) > self.max_structures:
+            self._structures.popitem(last=False)
+        return structure
+
+    def analyze(self, request):
+        '''
+        return the results of a job request, see handle.
+        '''
+        pdb_file = request['file']
+        centroid_distance = float(request.get('centroid_distance', 5.0))
+        dih_parallel = float(request.get('dih_parallel', 25))
+        dih_tshape = float(request.get('dih_tshape', 80))
+        details = request.get('details', False)
+        with recorded(self.stats, pdb_file):
+            structure = self.structure(pdb_file)
+            self.stats.add('atoms', len(structure.coords))
+            self.stats.add('residues', len(structure.res_starts) - 1)
+            with timed(self.stats, 'ligand'):
+                if request.get('all_ligands'):
+                    exclude = PDBReader.EXCLUDED_LIGANDS | set(request.get('exclude', []))
+                    residues = PDBReader.ligand_residues(structure, exclude)
+                    results = []
+                else:
+                    lig_names = list(OrderedDict.fromkeys(request.get('ligands') or [request['ligand']]))
+                    residues = []
+                    results = {}
+                    for lig_name in lig_names:
+                        if lig_name in structure.res_index:
+                            residues.append(structure.res_index[lig_name][0])
+                        else:
+                            results[lig_name] = -1
+                            self.stats.add('ligands_not_found')
+            for res, ligAtoms, rings in residue_rings(pdb_file, structure, residues, centroid_distance, 0,
+                                                      request.get('pocket', False), self.rings,
+                                                      request.get('templates', False), self.stats):
+                if details:
+                    found = [interaction._asdict() for interaction in list_PiPi(
+                        structure, ligAtoms, rings, centroid_distance, dih_parallel, dih_tshape, self.stats)]
+                else:
+                    found = count_PiPi(ligAtoms, rings, centroid_distance, dih_parallel, dih_tshape, 0, self.stats)
+                start = ligAtoms[0]
+                if isinstance(results, list):
+                    results.append({'ligand': structure.resnames[start], 'chain': structure.chains[start],
+                                    'resnum': int(structure.resnums[start]), 'icode': structure.icodes[start].strip(),
+                                    'results': found})
+                else:
+                    results[structure.resnames[start]] = found
+        return results
+
+    def handle(self, request):
+        '''
+        request is a dict, either a job:
+            {"file": path, "ligands": [names] (or "ligand": name, or "all_ligands": true with an optional
+             "exclude" list), "centroid_distance", "dih_parallel", "dih_tshape", "pocket", "templates", "details"}
+        or an operation: {"op": "ping"}, {"op": "stats"}, {"op": "clear"} (empties the caches), {"op": "shutdown"}.
+        return the response dict, holding the "id" of the request if given and "results" or "error".
+        Job results map each ligand name to its count (or list of interactions if details), -1 if not found;
+        with all_ligands they are a list of {"ligand", "chain", "resnum", "icode", "results"}.
+        '''
+        response = {'id': request.get('id')} if 'id' in request else {}
+        self.requests += 1
+        try:
+            op = request.get('op', 'analyze')
+            if op == 'analyze':
+                response['results'] = self.analyze(request)
+            elif op == 'ping' or op == 'shutdown':
+                response['ok'] = True
+            elif op == 'stats':
+                response['stats'] = {'requests': self.requests, 'errors': self.errors,
+                                     'structures': len(self._structures), 'ring_hits': self.rings.hits,
+                                     'ring_misses': self.rings.misses, 'times': self.stats.times,
+                                     'counts': self.stats.counts}
+            elif op == 'clear':
+                self._structures.clear()
+                self.rings.clear()
+                response['ok'] = True
+            else:
+                raise ValueError('Unknown op: %s' % op)
+        except Exception as e:
+            self.errors += 1
+            response['error'] = '%s: %s' % (type(e).__name__, e)
+        return response
+
+    def serve_lines(self, lines, write):
+        '''
+        Answer each JSON line of lines by a JSON line given to write, until the end of lines or a shutdown,
+        return True on shutdown.
+        '''
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                write(json.dumps({'error': 'ValueError: %s' % e}) + '\n')
+                continue
+            write(json.dumps(self.handle(request)) + '\n')
+            if request.get('op') == 'shutdown':
+                return True
+        return False
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        def write(text):
+            self.wfile.write(text.encode('utf-8'))
+            self.wfile.flush()
+        if self.server.service.serve_lines(self.rfile, write):
+            self.server.stopped = True
+
+
+def serve_socket(service, path):
+    '''
+    Serve the JSON lines protocol on a Unix socket at path, one connection at a time, until a shutdown request.
+    '''
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError('Unix sockets are not available on this platform')
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise OSError('%s exists and is not a socket' % path)
+        os.remove(path)
+    server = socketserver.UnixStreamServer(path, _LineHandler)
+    server.service = service
+    server.stopped = False
+    try:
+        while not server.stopped:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Resident Pi-Pi detection service speaking JSON lines.')
+    parser.add_argument('--socket', default=None, help='listen on this Unix socket instead of stdin/stdout')
+    parser.add_argument('--max-structures', type=int, default=32,
+                        help='number of parsed structures and ring sets kept in memory')
+    args = parser.parse_args(argv)
+    service = PiPiService(args.max_structures)
+    if args.socket:
+        serve_socket(service, args.socket)
+    else:
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        service.serve_lines(iter(sys.stdin.readline, ''), write)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the PiViewer detection.
+A PiPiStats given as the stats argument of find_PiPi and friends records the time of each stage and the
+atom, ring and pair counts of every call. Stats of batch workers are merged through to_dict and merge,
+and exported as JSON or in the Prometheus text format. Nothing is recorded when no stats are given.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Stages of a call, in order: PDBReader parsing, ligand lookup, OpenBabel reading (parsing and bond perception),
+# ring perception (SSSR, aromaticity, templates and geometry) and pair evaluation.
+STAGES = ('parse', 'ligand', 'ob_read', 'rings', 'pairs')
+
+# Counters of a call.
+COUNTERS = ('calls', 'atoms', 'residues', 'ligands', 'ligands_not_found', 'rings', 'ligand_aromatic_rings',
+            'receptor_aromatic_rings', 'pair_tests', 'interactions')
+
+
+class PiPiStats(object):
+    """
+    Totals over the recorded calls, per call records are kept if keep_calls
+    and passed to callback(record) at the end of each call.
+    A record is a dict of the file, the stage times in seconds and the counters.
+    A stage started while another one runs pauses it, so that each stage only counts its own time.
+    """
+
+    def __init__(self, callback=None, keep_calls=False):
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.callback = callback
+        self.keep_calls = keep_calls
+        self.calls = []
+        self._call = None
+        self._running = []
+
+    def begin(self, pdb_file):
+        '''
+        Start the record of a call on pdb_file.
+        '''
+        self._call = {'file': pdb_file, 'times': dict.fromkeys(STAGES, 0.0), 'counts': dict.fromkeys(COUNTERS, 0)}
+        self._running = []
+        self.add('calls')
+
+    def end(self):
+        '''
+        Close the record of the current call.
+        '''
+        call, self._call = self._call, None
+        self._running = []
+        if call is None:
+            return
+        if self.keep_calls:
+            self.calls.append(call)
+        if self.callback is not None:
+            self.callback(call)
+
+    def start(self, stage):
+        now = timer()
+        if self._running:
+            self._record(self._running[-1][0], now - self._running[-1][1])
+        self._running.append([stage, now])
+
+    def stop(self, stage):
+        now = timer()
+        running = self._running[-1][0] if self._running else None
+        if running != stage:
+            raise ValueError('Stage %s stopped while %s runs' % (stage, running))
+        _, since = self._running.pop()
+        self._record(stage, now - since)
+        if self._running:
+            self._running[-1][1] = now
+
+    def _record(self, stage, elapsed):
+        self.times[stage] += elapsed
+        if self._call is not None:
+            self._call['times'][stage] += elapsed
+
+    def add(self, counter, n=1):
+        self.counts[counter] += n
+        if self._call is not None:
+            self._call['counts'][counter] += n
+
+    def pairs(self, lig_rings, rec_rings, found):
+        '''
+        Count the aromatic rings of both sides of one ligand, their pair tests and the interactions found.
+        '''
+        self.add('ligand_aromatic_rings', lig_rings)
+        self.add('receptor_aromatic_rings', rec_rings)
+        self.add('pair_tests', lig_rings * rec_rings)
+        self.add('interactions', found)
+
+    def merge(self, other):
+        '''
+        Add the totals and the call records of other, a PiPiStats or its to_dict.
+        '''
+        if isinstance(other, PiPiStats):
+            other = other.to_dict()
+        for stage, value in other['times'].items():
+            self.times[stage] = self.times.get(stage, 0.0) + value
+        for counter, value in other['counts'].items():
+            self.counts[counter] = self.counts.get(counter, 0) + value
+        self.calls.extend(other.get('calls', []))
+        return self
+
+    def to_dict(self):
+        return {'times': dict(self.times), 'counts': dict(self.counts), 'calls': list(self.calls)}
+
+    def to_json(self, indent=None):
+        return json.dumps(self.to_dict(), indent=indent, sort_keys=True)
+
+    def to_prometheus(self, prefix='piviewer'):
+        '''
+        return the totals in the Prometheus text exposition format.
+        '''
+        lines = ['# HELP %s_stage_seconds_total Time spent in each stage of the detection.' % prefix,
+                 '# TYPE %s_stage_seconds_total counter' % prefix]
+        lines += ['%s_stage_seconds_total{stage="%s"} %.6f' % (prefix, stage, self.times[stage]) for stage in STAGES]
+        for counter in COUNTERS:
+            lines += ['# TYPE %s_%s_total counter' % (prefix, counter),
+                      '%s_%s_total %d' % (prefix, counter, self.counts[counter])]
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def recorded(stats, pdb_file):
+    '''
+    Record a call on pdb_file in stats, a PiPiStats or None, closing the record even if the call raises.
+    '''
+    if stats is not None: stats.begin(pdb_file)
+    try:
+        yield
+    finally:
+        if stats is not None: stats.end()
+
+
+@contextmanager
+def timed(stats, stage):
+    '''
+    Time a stage in stats, a PiPiStats or None, stopping it even if the stage raises.
+    '''
+    if stats is not None: stats.start(stage)
+    try:
+        yield
+    finally:
+        if stats is not None: stats.stop(stage)
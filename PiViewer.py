@@ -36,108 +36,623 @@ Created by Hu Ge <gehuchina@gmail.com>
 import openbabel as ob
 import pybel
 import numpy as np
+from collections import namedtuple
 
-# Define vecAngle for the degree between two vectors.
-def vecAngle(vec1, vec2):
+import PDBReader
+import RingTemplates
+from PiPiStats import recorded, timed
+
+# Rings of a molecule: ring_id is the index in atoms and in each array.
+RingSet = namedtuple('RingSet', ['atoms', 'aromatic', 'centers', 'normals'])
+
+
+# Perceive the rings of the whole molecule once.
+def perceive_rings(mol):
     '''
-    vec1,vec2 are ob.vector3 objects,
-    return the angle between them in degree.
+    mol is a pybel molecule,
+    return a RingSet of the SSSR with ring centers and normals as (N,3) arrays.
     '''
-    dotprod = vec1.GetX() * vec2.GetX() + vec1.GetY() * vec2.GetY() + vec1.GetZ() * vec2.GetZ()
-    deg = np.arccos(dotprod) * 180 / np.pi
-    if deg > 90:
-        deg = 180 - deg
-    return deg
+    center = ob.vector3()
+    norm1 = ob.vector3()
+    norm2 = ob.vector3()
+    atoms = []
+    aromatic = []
+    coords = []
+    for ring in mol.sssr:
+        ring.findCenterAndNormal(center, norm1, norm2)
+        atoms.append(tuple(ring._path))
+        aromatic.append(ring.IsAromatic())
+        coords.append((center.GetX(), center.GetY(), center.GetZ(), norm1.GetX(), norm1.GetY(), norm1.GetZ()))
+    coords = np.array(coords, dtype=float).reshape(-1, 6)
+    return RingSet(atoms, np.array(aromatic, dtype=bool), coords[:, :3], coords[:, 3:])
+
+
+# Perceive the rings of a molecule read from part of a PDBReader.Structure.
+def structure_rings(mol, atoms):
+    '''
+    mol is a pybel molecule read from the structure atoms (sorted atom indices given to PDBReader.pdb_block),
+    return its RingSet with the ring atoms numbered as the structure atoms.
+    '''
+    rings = perceive_rings(mol)
+    atoms = atoms.tolist()
+    return rings._replace(atoms=[tuple(atoms[i - 1] for i in ring) for ring in rings.atoms])
+
+
+# Hand part of a structure to OpenBabel, which parses it and perceives its bonds.
+def read_atoms(structure, atoms, stats=None):
+    '''
+    structure is a PDBReader.Structure, atoms are sorted atom indices, stats is a PiPiStats.PiPiStats or None,
+    return the pybel molecule of these atoms, its reading is timed as the ob_read stage.
+    '''
+    with timed(stats, 'ob_read'):
+        mol = pybel.readstring('pdb', PDBReader.pdb_block(structure, atoms))
+    return mol
+
+
+# Rings of part of a structure: standard residues from RingTemplates, the other residues perceived by OpenBabel.
+def template_rings(structure, atoms, stats=None):
+    '''
+    structure is a PDBReader.Structure, atoms are sorted atom indices,
+    return the RingSet numbered as the structure atoms, the template rings follow the perceived ones.
+    '''
+    isStandard = RingTemplates.standard_atoms(structure, atoms)
+    others = atoms[~isStandard]
+    if len(others):
+        rings = structure_rings(read_atoms(structure, others, stats), others)
+    else:
+        rings = RingSet([], np.zeros(0, dtype=bool), np.zeros((0, 3)), np.zeros((0, 3)))
+    residues = np.unique(structure.atom_res[atoms[isStandard]])
+    ring_atoms, aromatic = RingTemplates.template_ring_atoms(structure, residues)
+    centers, normals = ring_geometry(structure.coords, ring_atoms)
+    return RingSet(rings.atoms + ring_atoms, np.append(rings.aromatic, np.array(aromatic, dtype=bool)),
+                   np.vstack((rings.centers, centers)), np.vstack((rings.normals, normals)))
+
+
+# Get the rings of the non water atoms of a structure file, through the cache if given.
+def file_rings(pdb_file, structure, cache=None, templates=False, stats=None):
+    '''
+    structure is the PDBReader.Structure of pdb_file, cache is a RingCache.RingCache or None,
+    templates takes the rings of standard residues from RingTemplates,
+    stats is a PiPiStats.PiPiStats timing the OpenBabel reading or None,
+    return the RingSet numbered as the structure atoms.
+    '''
+    if cache is not None:
+        key = cache.key(pdb_file, ob.OBReleaseVersion() + ('+templates' if templates else ''))
+        entry = cache.get(key)
+        if entry is not None:
+            return RingSet(entry['atoms'], entry['aromatic'], entry['centers'], entry['normals'])
+    atoms = PDBReader.non_water_atoms(structure)
+    if templates:
+        rings = template_rings(structure, atoms, stats)
+    else:
+        rings = structure_rings(read_atoms(structure, atoms, stats), atoms)
+    if cache is not None:
+        first = [structure.res_starts[structure.atom_res[ring[0]]] for ring in rings.atoms]
+        cache.put(key, rings, [structure.resnames[i] for i in first], [structure.chains[i] for i in first],
+                  [structure.resnums[i] for i in first])
+    return rings
+
+
+# Centers and normals of rings straight from atom coordinates, as ob.OBRing.findCenterAndNormal does.
+def ring_geometry(coords, ring_atoms):
+    '''
+    coords is an (N,3) array, ring_atoms a list of atom index tuples in ring order,
+    return the (M,3) ring centers and (M,3) unit normals, rings of the same size are computed together.
+    '''
+    centers = np.zeros((len(ring_atoms), 3))
+    normals = np.zeros((len(ring_atoms), 3))
+    sizes = np.array([len(ring) for ring in ring_atoms], dtype=int)
+    for size in np.unique(sizes):
+        rows = np.nonzero(sizes == size)[0]
+        xyz = coords[np.array([ring_atoms[i] for i in rows], dtype=int)]
+        center = xyz.mean(axis=1)
+        rel = xyz - center[:, np.newaxis, :]
+        norm = np.cross(rel, np.roll(rel, -1, axis=1)).sum(axis=1)
+        centers[rows] = center
+        normals[rows] = norm / np.linalg.norm(norm, axis=1)[:, np.newaxis]
+    return centers, normals
+
+
+# Distances and angles of all ring pairs at once.
+def pair_geometry(centers1, normals1, centers2, normals2):
+    '''
+    centers and normals are (N,3) and (M,3) arrays,
+    return the (N,M) centroid distances and the (N,M) angles between the ring planes in degree.
+    '''
+    dist = np.sqrt(((centers1[:, np.newaxis, :] - centers2[np.newaxis, :, :]) ** 2).sum(axis=2))
+    dotprod = np.abs(np.dot(normals1, normals2.T))
+    angle = np.degrees(np.arccos(np.clip(dotprod, 0.0, 1.0)))
+    return dist, angle
+
+
+# The criteria applied to arrays of distances and angles.
+def pipi_mask(dist, angle, centroid_distance=5.0, dih_parallel=25, dih_tshape=80):
+    '''
+    return the boolean mask of the ring pairs forming Pi-Pi interactions.
+    '''
+    return (dist < centroid_distance) & ((angle < dih_parallel) | (angle > dih_tshape))
+
+
+# Receptor ring atoms lie within centroid_distance plus twice a ring radius of a ligand atom.
+POCKET_MARGIN = 3.0
+
+# Uniform grid over atom coordinates: atoms sorted by the linear index of their cell.
+Grid = namedtuple('Grid', ['cell', 'origin', 'dims', 'keys', 'order'])
+
+
+def build_grid(coords, cell):
+    '''
+    Index the (N,3) coordinates on a grid of the given cell size.
+    '''
+    origin = coords.min(axis=0) if len(coords) else np.zeros(3)
+    ijk = np.floor((coords - origin) / cell).astype(np.int64)
+    dims = ijk.max(axis=0) + 1 if len(coords) else np.ones(3, dtype=np.int64)
+    keys = (ijk[:, 0] * dims[1] + ijk[:, 1]) * dims[2] + ijk[:, 2]
+    order = np.argsort(keys, kind='mergesort')
+    return Grid(cell, origin, dims, keys[order], order)
+
+
+def grid_query(grid, coords, points, cutoff):
+    '''
+    return the sorted indices of the atoms within cutoff of any of the (M,3) points.
+    '''
+    reach = int(np.ceil(cutoff / grid.cell))
+    steps = np.arange(-reach, reach + 1)
+    offsets = np.array(np.meshgrid(steps, steps, steps, indexing='ij')).reshape(3, -1).T
+    ijk = np.floor((points - grid.origin) / grid.cell).astype(np.int64)
+    cells = np.unique((ijk[:, np.newaxis, :] + offsets[np.newaxis, :, :]).reshape(-1, 3), axis=0)
+    cells = cells[np.all((cells >= 0) & (cells < grid.dims), axis=1)]
+    keys = (cells[:, 0] * grid.dims[1] + cells[:, 1]) * grid.dims[2] + cells[:, 2]
+    lo = np.searchsorted(grid.keys, keys, 'left')
+    hi = np.searchsorted(grid.keys, keys, 'right')
+    candidates = np.concatenate([grid.order[l:h] for l, h in zip(lo, hi)] + [np.zeros(0, dtype=int)])
+    d2 = ((coords[candidates, np.newaxis, :] - points[np.newaxis, :, :]) ** 2).sum(axis=2)
+    return np.sort(candidates[(d2 <= cutoff * cutoff).any(axis=1)])
+
+
+# All pairs of close points, each point only compared with those of its own and the 26 adjacent cells.
+def grid_pairs(points, cutoff):
+    '''
+    points is an (N,3) array,
+    return the index arrays i and j of the pairs of points closer than cutoff, with i < j, sorted.
+    '''
+    if len(points) < 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    grid = build_grid(points, cutoff)
+    ijk = np.floor((points - grid.origin) / grid.cell).astype(np.int64)
+    steps = np.arange(-1, 2)
+    offsets = np.array(np.meshgrid(steps, steps, steps, indexing='ij')).reshape(3, -1).T
+    first = []
+    second = []
+    for offset in offsets:
+        cells = ijk + offset
+        valid = np.nonzero(np.all((cells >= 0) & (cells < grid.dims), axis=1))[0]
+        keys = (cells[valid, 0] * grid.dims[1] + cells[valid, 1]) * grid.dims[2] + cells[valid, 2]
+        lo = np.searchsorted(grid.keys, keys, 'left')
+        counts = np.searchsorted(grid.keys, keys, 'right') - lo
+        # Positions in grid.order of the points of every cell, one run per point of valid.
+        positions = np.arange(counts.sum()) + np.repeat(lo - np.cumsum(counts) + counts, counts)
+        i = np.repeat(valid, counts)
+        j = grid.order[positions]
+        keep = i < j
+        first.append(i[keep])
+        second.append(j[keep])
+    i = np.concatenate(first)
+    j = np.concatenate(second)
+    keep = ((points[i] - points[j]) ** 2).sum(axis=1) < cutoff * cutoff
+    i, j = i[keep], j[keep]
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+# The ligand and the residues around it.
+def pocket_atoms(structure, lig_atoms, grid, cutoff):
+    '''
+    structure is a PDBReader.Structure indexed by grid, lig_atoms are the atom indices of the ligand residue,
+    return the sorted atom indices of every non water residue with any atom within cutoff of a ligand atom.
+    '''
+    near = grid_query(grid, structure.coords, structure.coords[lig_atoms], cutoff)
+    residues = np.unique(np.append(structure.atom_res[near], structure.atom_res[lig_atoms[0]]))
+    residues = [r for r in residues if structure.resnames[structure.res_starts[r]] not in PDBReader.WATER_NAMES]
+    return np.concatenate([PDBReader.residue_atoms(structure, r) for r in residues])
+
+
+# Hand OpenBabel only the ligand and the residues around it.
+def load_pocket(structure, lig_atoms, grid, cutoff, stats=None):
+    '''
+    return the pocket as a pybel molecule and its atom indices in the structure, see pocket_atoms and read_atoms.
+    '''
+    atoms = pocket_atoms(structure, lig_atoms, grid, cutoff)
+    return read_atoms(structure, atoms, stats), atoms
+
+
+# Geometry of every ligand and receptor aromatic ring pair.
+def ligand_pairs(lig_atoms, rings):
+    '''
+    lig_atoms are the atom indices of the ligand residue, numbered as the ring atoms,
+    return the mask of the ligand rings, the ligand and receptor aromatic ring_ids,
+    and the (L,R) centroid distances and angles of their pairs.
+    '''
+    ligAtomIdSet = set(lig_atoms)
+    # Determine which rings are from ligand.
+    isLigRing = np.array([not ligAtomIdSet.isdisjoint(ring_atoms) for ring_atoms in rings.atoms], dtype=bool)
+    ligAroRingIds = np.nonzero(isLigRing & rings.aromatic)[0]
+    recAroRingIds = np.nonzero(~isLigRing & rings.aromatic)[0]
+    dist, angle = pair_geometry(rings.centers[ligAroRingIds], rings.normals[ligAroRingIds],
+                                rings.centers[recAroRingIds], rings.normals[recAroRingIds])
+    return isLigRing, ligAroRingIds, recAroRingIds, dist, angle
+
+
+# Evaluate a whole grid of criteria on the ring pairs at once.
+def sweep_counts(dist, angle, distances, parallels, tshapes):
+    '''
+    dist and angle are arrays of ring pairs, distances, parallels and tshapes are lists of criteria values,
+    return the (D,P,T) array of the numbers of pairs meeting each combination of the criteria.
+    '''
+    distances = np.asarray(distances, dtype=float)
+    parallels = np.asarray(parallels, dtype=float)
+    tshapes = np.asarray(tshapes, dtype=float)
+    dist = np.ravel(dist)
+    angle = np.ravel(angle)
+    keep = dist < distances.max()
+    dist, angle = dist[keep], angle[keep]
+    near = (dist[:, np.newaxis] < distances).astype(int)
+    oriented = ((angle[:, np.newaxis, np.newaxis] < parallels[:, np.newaxis]) |
+                (angle[:, np.newaxis, np.newaxis] > tshapes)).astype(int)
+    return np.einsum('nd,npt->dpt', near, oriented)
+
+
+# One Pi-Pi interaction: residue name, chain, number and insertion code ('' if none), ring_id, ring atom serial
+# numbers and ring center of the ligand then of the receptor ring, centroid distance, angle and type
+# ('parallel' or 'T-shaped').
+PiPiInteraction = namedtuple('PiPiInteraction', [
+    'lig_name', 'lig_chain', 'lig_resnum', 'lig_icode', 'lig_ring_id', 'lig_ring_atoms', 'lig_x', 'lig_y', 'lig_z',
+    'rec_name', 'rec_chain', 'rec_resnum', 'rec_icode', 'rec_ring_id', 'rec_ring_atoms', 'rec_x', 'rec_y', 'rec_z',
+    'distance', 'angle', 'type'])
+
+
+# List the Pi-Pi interactions between one ligand residue and the receptor rings.
+def list_PiPi(structure, lig_atoms, rings, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, stats=None):
+    '''
+    structure is the PDBReader.Structure the rings are numbered by, lig_atoms the atom indices of the ligand,
+    stats is a PiPiStats.PiPiStats or None,
+    return the list of PiPiInteraction found.
+    '''
+    with timed(stats, 'pairs'):
+        isLigRing, ligAroRingIds, recAroRingIds, dist, angle = ligand_pairs(lig_atoms, rings)
+        mask = pipi_mask(dist, angle, centroid_distance, dih_parallel, dih_tshape)
+        interactions = []
+        for i, j in zip(*np.nonzero(mask)):
+            sides = []
+            for ring_id in (ligAroRingIds[i], recAroRingIds[j]):
+                ring_atoms = rings.atoms[ring_id]
+                first = structure.res_starts[structure.atom_res[ring_atoms[0]]]
+                center = rings.centers[ring_id]
+                sides += [structure.resnames[first], structure.chains[first], int(structure.resnums[first]),
+                          structure.icodes[first].strip(), int(ring_id),
+                          tuple(int(structure.serials[k]) for k in ring_atoms),
+                          float(center[0]), float(center[1]), float(center[2])]
+            interactions.append(PiPiInteraction(*(sides + [float(dist[i, j]), float(angle[i, j]),
+                                                           'parallel' if angle[i, j] < dih_parallel else 'T-shaped'])))
+        if stats is not None: stats.pairs(len(ligAroRingIds), len(recAroRingIds), len(interactions))
+    return interactions
+
+
+# Count the Pi-Pi interactions between one ligand residue and the rest of the molecule.
+def count_PiPi(lig_atoms, rings, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, verbose=1, stats=None):
+    """
+    Count Pi-Pi interactions between the ligand residue and the receptor rings.
+    :param lig_atoms: atom indices of the ligand residue, numbered as the ring atoms.
+    :param rings: RingSet of the molecule, as returned by perceive_rings or structure_rings.
+    :param centroid_distance: Max ring centroid distance
+    :param dih_parallel: Max dihedral (parallel)
+    :param dih_tshape: Min dihedral (T-shaped)
+    :param stats: PiPiStats.PiPiStats counting the rings and pairs tested
+    :return: number of Pi-Pi interactions found
+    """
+    with timed(stats, 'pairs'):
+        isLigRing, ligAroRingIds, recAroRingIds, dist, angle = ligand_pairs(lig_atoms, rings)
+        if verbose:
+            for ring_id in np.nonzero(isLigRing)[0]:
+                print "ligand ring_ID: ", ring_id, "aromatic" if rings.aromatic[ring_id] else "saturated"
+        if verbose: print "\nReceptor has ", np.count_nonzero(~isLigRing), " rings,",
+        if verbose: print " has ", len(recAroRingIds), " aromatic rings."
+
+        # Test all the ligand and receptor aromatic ring pairs at once
+        mask = pipi_mask(dist, angle, centroid_distance, dih_parallel, dih_tshape)
+        count = int(np.count_nonzero(mask))
+        if verbose:
+            for i, j in zip(*np.nonzero(mask)):
+                print "Pi-Pi ring pairs: %3s,%3s  Angle(deg.): %5.2f  Distance(A): %.2f" % (recAroRingIds[j], ligAroRingIds[i], angle[i, j], dist[i, j])
+        if verbose: print "Total Pi-Pi interactions:", count
+        if stats is not None: stats.pairs(len(ligAroRingIds), len(recAroRingIds), count)
+    return count
 
 
 # The main PiPi viewer function
-def find_PiPi(pdb_file, lig_name, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, verbose=1):
+def find_PiPi(pdb_file, lig_name, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, verbose=1, pocket=False,
+              cache=None, templates=False, stats=None):
     """
     Find Pi-Pi interactions around the specified ligand residue from the pdb file.
-    :param pdb_file: path of the target file in PDB format.
+    :param pdb_file: path of the target file in PDB or mmCIF format, optionally gzipped.
     :param lig_name: ligand residue name.
     :param centroid_distance: Max ring centroid distance
     :param dih_parallel: Max dihedral (parallel)
     :param dih_tshape: Min dihedral (T-shaped)
+    :param pocket: perceive rings only in the residues near the ligand
+    :param cache: RingCache.RingCache reusing the rings perceived for the same file, not used in pocket mode
+    :param templates: take the rings of standard residues from RingTemplates, OpenBabel only perceives the others
+    :param stats: PiPiStats.PiPiStats recording the stage times and counts of the call
     :return: number of Pi-Pi interactions found
     """
-    # Get ligand residue and print its name.
-    ligAtomList = []
-    ligAtomIdList = []
-    mol = pybel.readfile('pdb', pdb_file).next()
-    if verbose: print "A total of %s residues" % mol.OBMol.NumResidues()
-    lig = None
-    for res in ob.OBResidueIter(mol.OBMol):
-        # print res.GetName()
-        if res.GetName() == lig_name:
-            lig = res
-            if verbose: print "Ligand residue name is:", lig.GetName()
-            break
-    if not lig:
-        if verbose: print "No ligand residue %s found, please confirm." % lig_name
-        return -1
-    else:
-        for atom in ob.OBResidueAtomIter(lig):
-            # print atom.GetIdx()
-            ligAtomList.append(atom)
-            ligAtomIdList.append(atom.GetIdx())
+    return find_PiPi_multi(pdb_file, [lig_name], centroid_distance, dih_parallel, dih_tshape, verbose, pocket,
+                           cache, templates, stats)[lig_name]
 
-    # Set ring_id
-    i = 0
-    for ring in mol.sssr:
-        ring.ring_id = i
-        i += 1
-        # print ring.ring_id
 
-    # Determine which rings are from ligand.
-    ligRingList = []
-    ligAroRingList = []
-    ligRingIdList = []
-    recRingList = []
-    recAroRingList = []
-    for ring in mol.sssr:
-        for atom in ligAtomList:
-            if ring.IsMember(atom):
-                if ring not in ligRingList:
-                    ligRingList.append(ring)
-                    ligRingIdList.append(ring.ring_id)
-                    if verbose: print "ligand ring_ID: ", ring.ring_id,
-                    if ring.IsAromatic():
-                        if verbose: print "aromatic"
-                        ligAroRingList.append(ring)
-                    else:
-                        if verbose: print "saturated"
-    for ring in mol.sssr:
-        if ring.ring_id not in ligRingIdList:
-            recRingList.append(ring)
-            if ring.IsAromatic():
-                recAroRingList.append(ring)
-    if verbose: print "\nReceptor has ", len(recRingList), " rings,",
-    if verbose: print " has ", len(recAroRingList), " aromatic rings."
-
-    # Find and show the rings
-    ligRingCenter = ob.vector3()
-    recRingCenter = ob.vector3()
-    ligNorm1 = ob.vector3()
-    ligNorm2 = ob.vector3()
-    recNorm1 = ob.vector3()
-    recNorm2 = ob.vector3()
-    count = 0
-    lig_ring_index = 0
-    for ligRing in ligAroRingList:
-        lig_ring_index += 1
-        ligRing.findCenterAndNormal(ligRingCenter, ligNorm1, ligNorm2)
-        rec_ring_index = 0
-        for recRing in recAroRingList:
-            rec_ring_index += 1
-            recRing.findCenterAndNormal(recRingCenter, recNorm1, recNorm2)
-            dist = ligRingCenter.distSq(recRingCenter) ** 0.5
-            angle = vecAngle(ligNorm1, recNorm1)
-            if (dist < centroid_distance and (angle < dih_parallel or angle > dih_tshape)):  # the criteria
-                count += 1
-                if verbose: print "Pi-Pi ring pairs: %3s,%3s  Angle(deg.): %5.2f  Distance(A): %.2f" % (recRing.ring_id, ligRing.ring_id, angle, dist)
-    if verbose: print "Total Pi-Pi interactions:", count
-    return count
+# Find Pi-Pi interactions for several ligands with a single parse of the pdb file.
+def find_PiPi_multi(pdb_file, lig_names, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, verbose=1,
+                    pocket=False, cache=None, templates=False, stats=None):
+    """
+    Find Pi-Pi interactions around each of the specified ligand residues from the pdb file.
+    The file is indexed by PDBReader first: missing ligands are answered without OpenBabel,
+    which is only given the non water atoms, read and ring perceived once for all the ligands.
+    In pocket mode OpenBabel is instead given, per ligand, only the residues having an atom
+    within centroid_distance + POCKET_MARGIN of the ligand, and the ring_IDs refer to the pocket.
+    :param pdb_file: path of the target file in PDB or mmCIF format, optionally gzipped.
+    :param lig_names: list or set of ligand residue names.
+    :param centroid_distance: Max ring centroid distance
+    :param dih_parallel: Max dihedral (parallel)
+    :param dih_tshape: Min dihedral (T-shaped)
+    :param pocket: perceive rings only in the residues near each ligand
+    :param cache: RingCache.RingCache reusing the rings perceived for the same file, not used in pocket mode
+    :param templates: take the rings of standard residues from RingTemplates, OpenBabel only perceives the others
+    :param stats: PiPiStats.PiPiStats recording the stage times and counts of the call
+    :return: dict of ligand name to number of Pi-Pi interactions found, -1 if the ligand is not found
+    """
+    with recorded(stats, pdb_file):
+        results = {}
+        for lig_name, _, ligAtoms, rings in ligand_rings(pdb_file, lig_names, centroid_distance, verbose, pocket, cache,
+                                                         templates, stats):
+            if rings is None:
+                results[lig_name] = -1
+            else:
+                results[lig_name] = count_PiPi(ligAtoms, rings, centroid_distance, dih_parallel, dih_tshape, verbose,
+                                               stats)
+    return results
+
+
+# Find Pi-Pi interactions for several ligands and return them in full.
+def find_PiPi_interactions(pdb_file, lig_names, centroid_distance=5.0, dih_parallel=25, dih_tshape=80,
+                           pocket=False, cache=None, templates=False, stats=None):
+    """
+    Find Pi-Pi interactions around each of the specified ligand residues from the pdb file, see find_PiPi_multi.
+    :param pdb_file: path of the target file in PDB or mmCIF format, optionally gzipped.
+    :param lig_names: list or set of ligand residue names.
+    :param centroid_distance: Max ring centroid distance
+    :param dih_parallel: Max dihedral (parallel)
+    :param dih_tshape: Min dihedral (T-shaped)
+    :param pocket: perceive rings only in the residues near each ligand
+    :param cache: RingCache.RingCache reusing the rings perceived for the same file, not used in pocket mode
+    :param templates: take the rings of standard residues from RingTemplates, OpenBabel only perceives the others
+    :param stats: PiPiStats.PiPiStats recording the stage times and counts of the call
+    :return: dict of ligand name to the list of PiPiInteraction found, -1 if the ligand is not found
+    """
+    with recorded(stats, pdb_file):
+        results = {}
+        for lig_name, structure, ligAtoms, rings in ligand_rings(pdb_file, lig_names, centroid_distance, 0, pocket,
+                                                                cache, templates, stats):
+            if rings is None:
+                results[lig_name] = -1
+            else:
+                results[lig_name] = list_PiPi(structure, ligAtoms, rings, centroid_distance, dih_parallel, dih_tshape,
+                                              stats)
+    return results
+
+
+# Evaluate a grid of criteria for several ligands with a single parse of the pdb file.
+def sweep_PiPi(pdb_file, lig_names, distances, parallels, tshapes, pocket=False, cache=None, templates=False,
+               stats=None):
+    """
+    Count Pi-Pi interactions of each ligand for every combination of the criteria values.
+    The ring pair distances and angles are computed once per ligand, see find_PiPi_multi.
+    :param pdb_file: path of the target file in PDB or mmCIF format, optionally gzipped.
+    :param lig_names: list or set of ligand residue names.
+    :param distances: Max ring centroid distances
+    :param parallels: Max dihedrals (parallel)
+    :param tshapes: Min dihedrals (T-shaped)
+    :param pocket: perceive rings only in the residues near each ligand, within max(distances)
+    :param cache: RingCache.RingCache reusing the rings perceived for the same file, not used in pocket mode
+    :param templates: take the rings of standard residues from RingTemplates, OpenBabel only perceives the others
+    :param stats: PiPiStats.PiPiStats recording the stage times and counts of the call
+    :return: dict of ligand name to the (D,P,T) array of counts, -1 if the ligand is not found
+    """
+    with recorded(stats, pdb_file):
+        results = {}
+        for lig_name, _, ligAtoms, rings in ligand_rings(pdb_file, lig_names, max(distances), 0, pocket, cache,
+                                                         templates, stats):
+            if rings is None:
+                results[lig_name] = -1
+            else:
+                with timed(stats, 'pairs'):
+                    dist, angle = ligand_pairs(ligAtoms, rings)[3:]
+                    results[lig_name] = sweep_counts(dist, angle, distances, parallels, tshapes)
+                    if stats is not None: stats.pairs(dist.shape[0], dist.shape[1], 0)
+    return results
+
+
+# Load the rings around each ligand of the pdb file.
+def ligand_rings(pdb_file, lig_names, centroid_distance=5.0, verbose=1, pocket=False, cache=None, templates=False,
+                 stats=None):
+    '''
+    return a generator of (lig_name, PDBReader.Structure, ligand atom indices, RingSet) for each distinct name
+    of lig_names, with None atoms and rings if the ligand is not found, see find_PiPi_multi.
+    '''
+    with timed(stats, 'parse'):
+        structure = PDBReader.read_structure(pdb_file)
+    if stats is not None: stats.add('atoms', len(structure.coords))
+    if stats is not None: stats.add('residues', len(structure.res_starts) - 1)
+    if verbose: print "A total of %s residues" % (len(structure.res_starts) - 1)
+    with timed(stats, 'ligand'):
+        found = []
+        missing = []
+        for lig_name in lig_names:
+            if lig_name in found:
+                continue
+            if lig_name not in structure.res_index:
+                if verbose: print "No ligand residue %s found, please confirm." % lig_name
+                if stats is not None: stats.add('ligands_not_found')
+                missing.append(lig_name)
+                continue
+            found.append(lig_name)
+        residues = [structure.res_index[lig_name][0] for lig_name in found]
+    for lig_name in missing:
+        yield lig_name, structure, None, None
+    for lig_name, (_, ligAtoms, rings) in zip(found, residue_rings(pdb_file, structure, residues, centroid_distance,
+                                                                   verbose, pocket, cache, templates, stats)):
+        yield lig_name, structure, ligAtoms, rings
+
+
+# Load the rings around each of the given residues of the structure.
+def residue_rings(pdb_file, structure, residues, centroid_distance=5.0, verbose=1, pocket=False, cache=None,
+                  templates=False, stats=None):
+    '''
+    structure is the PDBReader.Structure of pdb_file, residues are residue indices,
+    return a generator of (residue index, atom indices, RingSet), see find_PiPi_multi.
+    '''
+    rings = None
+    grid = None
+    for res in residues:
+        ligAtoms = PDBReader.residue_atoms(structure, res)
+        if verbose: print "Ligand residue name is:", structure.resnames[ligAtoms[0]]
+        if stats is not None: stats.add('ligands')
+        if pocket:
+            with timed(stats, 'rings'):
+                cutoff = centroid_distance + POCKET_MARGIN
+                if grid is None:
+                    grid = build_grid(structure.coords, cutoff)
+                if templates:
+                    atoms = pocket_atoms(structure, ligAtoms, grid, cutoff)
+                    if verbose: print "Pocket has %s residues" % len(np.unique(structure.atom_res[atoms]))
+                    pocketRings = template_rings(structure, atoms, stats)
+                else:
+                    pocket_mol, atoms = load_pocket(structure, ligAtoms, grid, cutoff, stats)
+                    if verbose: print "Pocket has %s residues" % pocket_mol.OBMol.NumResidues()
+                    pocketRings = structure_rings(pocket_mol, atoms)
+                if stats is not None: stats.add('rings', len(pocketRings.atoms))
+            yield res, ligAtoms, pocketRings
+            continue
+        if rings is None:
+            with timed(stats, 'rings'):
+                rings = file_rings(pdb_file, structure, cache, templates, stats)
+                if stats is not None: stats.add('rings', len(rings.atoms))
+        yield res, ligAtoms, rings
+
+
+# Screen every ligand instance of the pdb file, no ligand names needed.
+def find_PiPi_ligands(pdb_file, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, verbose=1, pocket=False,
+                      cache=None, exclude=PDBReader.EXCLUDED_LIGANDS, details=False, templates=False, stats=None):
+    """
+    Find Pi-Pi interactions around every ligand residue of the pdb file, see find_PiPi_multi.
+    Ligands are the residues that are neither polymer residues nor named in exclude,
+    each copy is evaluated against the rest of the structure.
+    :param pdb_file: path of the target file in PDB or mmCIF format, optionally gzipped.
+    :param centroid_distance: Max ring centroid distance
+    :param dih_parallel: Max dihedral (parallel)
+    :param dih_tshape: Min dihedral (T-shaped)
+    :param pocket: perceive rings only in the residues near each ligand
+    :param cache: RingCache.RingCache reusing the rings perceived for the same file, not used in pocket mode
+    :param templates: take the rings of standard residues from RingTemplates, OpenBabel only perceives the others
+    :param stats: PiPiStats.PiPiStats recording the stage times and counts of the call
+    :param exclude: residue names never taken as ligands, waters, ions and buffer components by default
+    :param details: return the lists of PiPiInteraction instead of the counts
+    :return: dict of (ligand name, chain, residue number, insertion code or '') to the number of Pi-Pi
+             interactions found
+    """
+    with recorded(stats, pdb_file):
+        with timed(stats, 'parse'):
+            structure = PDBReader.read_structure(pdb_file)
+        if stats is not None: stats.add('atoms', len(structure.coords))
+        if stats is not None: stats.add('residues', len(structure.res_starts) - 1)
+        if verbose: print "A total of %s residues" % (len(structure.res_starts) - 1)
+        results = {}
+        with timed(stats, 'ligand'):
+            residues = PDBReader.ligand_residues(structure, exclude)
+        for res, ligAtoms, rings in residue_rings(pdb_file, structure, residues, centroid_distance, verbose, pocket,
+                                                  cache, templates, stats):
+            start = ligAtoms[0]
+            key = (structure.resnames[start], structure.chains[start], int(structure.resnums[start]),
+                   structure.icodes[start].strip())
+            if details:
+                results[key] = list_PiPi(structure, ligAtoms, rings, centroid_distance, dih_parallel, dih_tshape, stats)
+            else:
+                results[key] = count_PiPi(ligAtoms, rings, centroid_distance, dih_parallel, dih_tshape, verbose, stats)
+    return results
+
+
+# One Pi-Pi contact between two rings of a structure: residue name, chain, number and insertion code ('' if none),
+# ring_id, ring atom serial numbers and ring center of each ring, centroid distance, angle and type
+# ('parallel' or 'T-shaped').
+PiPiContact = namedtuple('PiPiContact', [
+    'name1', 'chain1', 'resnum1', 'icode1', 'ring_id1', 'ring_atoms1', 'x1', 'y1', 'z1',
+    'name2', 'chain2', 'resnum2', 'icode2', 'ring_id2', 'ring_atoms2', 'x2', 'y2', 'z2',
+    'distance', 'angle', 'type'])
+
+
+# Every Pi-Pi interaction between the residues of a structure, the stacking network of proteins and assemblies.
+def find_PiPi_network(pdb_file, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, between_chains=False,
+                      cache=None, templates=False, stats=None):
+    """
+    Find the Pi-Pi interactions between all the aromatic rings of the pdb file, ligands included.
+    Ring pairs are searched on a grid of the ring centers, so the time grows with the number of rings,
+    not with its square. Rings of the same residue are never paired.
+    :param pdb_file: path of the target file in PDB or mmCIF format, optionally gzipped.
+    :param centroid_distance: Max ring centroid distance
+    :param dih_parallel: Max dihedral (parallel)
+    :param dih_tshape: Min dihedral (T-shaped)
+    :param between_chains: only keep the pairs of rings of different chains, as at interfaces
+    :param cache: RingCache.RingCache reusing the rings perceived for the same file
+    :param templates: take the rings of standard residues from RingTemplates, OpenBabel only perceives the others
+    :param stats: PiPiStats.PiPiStats recording the stage times and counts of the call
+    :return: list of PiPiContact, the edges of the network, ordered by ring_id
+    """
+    with recorded(stats, pdb_file):
+        with timed(stats, 'parse'):
+            structure = PDBReader.read_structure(pdb_file)
+        if stats is not None: stats.add('atoms', len(structure.coords))
+        if stats is not None: stats.add('residues', len(structure.res_starts) - 1)
+        with timed(stats, 'rings'):
+            rings = file_rings(pdb_file, structure, cache, templates, stats)
+            if stats is not None: stats.add('rings', len(rings.atoms))
+
+        with timed(stats, 'pairs'):
+            aroRingIds = np.nonzero(rings.aromatic)[0]
+            firstAtoms = np.array([rings.atoms[ring_id][0] for ring_id in aroRingIds], dtype=int)
+            i, j = grid_pairs(rings.centers[aroRingIds], centroid_distance)
+            if stats is not None: stats.add('receptor_aromatic_rings', len(aroRingIds))
+            if stats is not None: stats.add('pair_tests', len(i))
+            keep = structure.atom_res[firstAtoms[i]] != structure.atom_res[firstAtoms[j]]
+            if between_chains:
+                chains = np.array([structure.chains[n] for n in firstAtoms])
+                keep &= chains[i] != chains[j]
+            i, j = aroRingIds[i[keep]], aroRingIds[j[keep]]
+            dist = np.sqrt(((rings.centers[i] - rings.centers[j]) ** 2).sum(axis=1))
+            dotprod = np.abs((rings.normals[i] * rings.normals[j]).sum(axis=1))
+            angle = np.degrees(np.arccos(np.clip(dotprod, 0.0, 1.0)))
+            contacts = []
+            for k in np.nonzero(pipi_mask(dist, angle, centroid_distance, dih_parallel, dih_tshape))[0]:
+                sides = []
+                for ring_id in (i[k], j[k]):
+                    ring_atoms = rings.atoms[ring_id]
+                    first = structure.res_starts[structure.atom_res[ring_atoms[0]]]
+                    center = rings.centers[ring_id]
+                    sides += [structure.resnames[first], structure.chains[first], int(structure.resnums[first]),
+                              structure.icodes[first].strip(), int(ring_id),
+                              tuple(int(structure.serials[n]) for n in ring_atoms),
+                              float(center[0]), float(center[1]), float(center[2])]
+                contacts.append(PiPiContact(*(sides + [float(dist[k]), float(angle[k]),
+                                                       'parallel' if angle[k] < dih_parallel else 'T-shaped'])))
+            if stats is not None: stats.add('interactions', len(contacts))
+    return contacts
 
 
 if __name__ == '__main__':
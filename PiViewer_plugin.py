@@ -33,122 +33,107 @@ Created by Hu Ge <gehuchina@gmail.com>
 # PERFORMANCE OF THIS SOFTWARE.
 # ----------------------------------------------------------------------
 
+from __future__ import absolute_import
 from pymol import cmd
+from pymol.cgo import BEGIN, END, LINES, COLOR, VERTEX, SPHERE, CYLINDER
 from Tkinter import *
 import tkFileDialog  # not included in TKinter standard
-import openbabel as ob
-import pybel
-import numpy as np
 import os
+import re
+import sys
+import multiprocessing
+import Queue
 
+# The search runs in PiViewer_worker, installed next to this file, which the dialog's child process imports by name.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from PiViewer_worker import PiPi_run, PiPi_jobs
 
-# Define vecAngle for the degree between two vectors.
-def vecAngle(vec1, vec2):
+
+# Colors (RGB) of the ligand and receptor ring centers and of the parallel and T-shaped pairs.
+LIG_RING_COLOR = [1.0, 0.5, 0.0]
+REC_RING_COLOR = [0.3, 0.6, 1.0]
+PARALLEL_COLOR = [1.0, 1.0, 0.0]
+TSHAPE_COLOR = [0.0, 1.0, 0.6]
+
+
+# The states of the target to analyze: a PDB file, or a PyMOL object or selection as it is in the session.
+def target_states(target, state=-1):
     '''
-    vec1,vec2 are ob.vector3 objects,
-    return the angle between them in degree.
+    target is the path of a PDB file or a PyMOL object or selection,
+    state -1 is the current state and 0 every state of the selection,
+    return a list of (state, PDB file path or None, PDB string or None), empty if the selection has no atoms.
+    Selections are read from the session here, call it from the GUI thread.
     '''
-    dotprod = vec1.GetX() * vec2.GetX() + vec1.GetY() * vec2.GetY() + vec1.GetZ() * vec2.GetZ()
-    deg = np.arccos(dotprod) * 180 / np.pi
-    if deg > 90:
-        deg = 180 - deg
-    return deg
+    if os.path.isfile(target):
+        return [(state if state > 0 else cmd.get_state(), target, None)]
+    if cmd.count_atoms(target) == 0:
+        return []
+    if state == 0:
+        states = range(1, cmd.count_states(target) + 1)
+    else:
+        states = [state if state > 0 else cmd.get_state()]
+    return [(st, None, cmd.get_pdbstr(target, st)) for st in states]
+
+
+# Draw the results of PiPi_run as one CGO object, replacing it, from the GUI thread.
+def show_results(results, name='PiViewer'):
+    cmd.delete(name)
+    for state, found, shapes in results:
+        if shapes:
+            cmd.load_cgo(shapes_cgo(shapes), name, state)
 
 
 # The main PiPi viewer function
-def PiPi(pdb_file, lig_name, centroid_distance, dih_parallel, dih_tshape):
-    # Get ligand residue and print its name.
-    ligAtomList = []
-    ligAtomIdList = []
-    mol = pybel.readfile('pdb', pdb_file).next()
-    print "A total of %s residues" % mol.OBMol.NumResidues()
-    lig = None
-    for res in ob.OBResidueIter(mol.OBMol):
-        # print res.GetName()
-        if res.GetName() == lig_name:
-            lig = res
-            print "Ligand residue name is: ", lig.GetName()
-            break
-    if not lig:
-        print "No ligand residue %s found, please confirm." % lig_name
+def PiPi(target, lig_name, centroid_distance=5.0, dih_parallel=25, dih_tshape=80, state=-1, name='PiViewer'):
+    '''
+    target is the path of a PDB file or a PyMOL object or selection, taken at state,
+    state -1 is the current state and 0 runs every state of the selection in turn.
+    The rings and pairs found are drawn as the CGO object name, one state per state analyzed,
+    a new run replaces the object.
+    From the PyMOL command line: PiPi 1acj, THA, 5.0, 25, 80
+    '''
+    states = target_states(target, int(state))
+    if not states:
+        print "No atoms in selection %s, please confirm." % target
         return 0
-    else:
-        for atom in ob.OBResidueAtomIter(lig):
-            # print atom.GetIdx()
-            ligAtomList.append(atom)
-            ligAtomIdList.append(atom.GetIdx())
-
-    # Set ring_id
-    i = 0
-    for ring in mol.sssr:
-        ring.ring_id = i
-        i += 1
-        # print ring.ring_id
-
-    # Determine which rings are from ligand.
-    ligRingList = []
-    ligAroRingList = []
-    ligRingIdList = []
-    recRingList = []
-    recAroRingList = []
-    for ring in mol.sssr:
-        for atom in ligAtomList:
-            if ring.IsMember(atom):
-                if ring not in ligRingList:
-                    ligRingList.append(ring)
-                    ligRingIdList.append(ring.ring_id)
-                    print "ligand ring_ID: ", ring.ring_id,
-                    if ring.IsAromatic():
-                        print "Aromatic"
-                        ligAroRingList.append(ring)
-                    else:
-                        print "Saturated"
-    for ring in mol.sssr:
-        if ring.ring_id not in ligRingIdList:
-            recRingList.append(ring)
-            if ring.IsAromatic():
-                recAroRingList.append(ring)
-    print "\nReceptor has ", len(recRingList), " rings,",
-    print " has ", len(recAroRingList), " aromatic rings."
-
-    # Find and show the rings
-    ligRingCenter = ob.vector3()
-    recRingCenter = ob.vector3()
-    ligNorm1 = ob.vector3()
-    ligNorm2 = ob.vector3()
-    recNorm1 = ob.vector3()
-    recNorm2 = ob.vector3()
-    coord1 = []
-    coord2 = []
-    pair = []  # Store the names of the objects
-    pairList = []
-    psObjectList = []
-    i = 0
-    for ligRing in ligAroRingList:
-        ligRing.findCenterAndNormal(ligRingCenter, ligNorm1, ligNorm2)
-        coord1 = [ligRingCenter.GetX(), ligRingCenter.GetY(), ligRingCenter.GetZ()]
-        # Create a pseudoatom for the centroid of each ring in the ligand
-        objectName1 = 'psCenter%.2d' % i
-        i += 1
-        cmd.pseudoatom(object=objectName1, pos=coord1)
-        psObjectList.append(objectName1)
-        for recRing in recAroRingList:
-            recRing.findCenterAndNormal(recRingCenter, recNorm1, recNorm2)
-            dist = ligRingCenter.distSq(recRingCenter)
-            angle = vecAngle(ligNorm1, recNorm1)
-            if (dist ** 0.5 < centroid_distance and (angle < dih_parallel or angle > dih_tshape)):  # the criteria
-                coord2 = [recRingCenter.GetX(), recRingCenter.GetY(), recRingCenter.GetZ()]
-                # Create pseudoatom for each lig ring center
-                objectName2 = 'psCenter%.2d' % i
-                i += 1
-                cmd.pseudoatom(object=objectName2, pos=coord2)
-                psObjectList.append(objectName2)
-                # pair=[coord1,coord2]
-                pair = [objectName1, objectName2]
-                # print "%.4f,%.4f,%.4f" % (pair[1][0],pair[1][1],pair[1][2])
-                pairList.append(pair)
-                cmd.distance('dist-' + objectName1 + '-' + objectName2, pair[0], pair[1])
-                print objectName1, objectName2, " angle is : %.2f" % angle
+    results = PiPi_run(states, lig_name, float(centroid_distance), float(dih_parallel), float(dih_tshape))
+    show_results(results, name)
+    return sum(found for _, found, _ in results)
+
+
+# CGO of the shapes of a state found by PiPi_state.
+def shapes_cgo(shapes):
+    cgo = []
+    for shape in shapes:
+        if shape[0] == 'ring':
+            cgo.extend(ring_cgo(shape[1], shape[2], LIG_RING_COLOR if shape[3] == 'ligand' else REC_RING_COLOR))
+        else:
+            cgo.extend(pair_cgo(shape[1], shape[2], PARALLEL_COLOR if shape[3] == 'parallel' else TSHAPE_COLOR))
+    return cgo
+
+
+# CGO of a ring: a sphere at its center and a stick along its normal.
+def ring_cgo(center, normal, color, radius=0.3, length=1.0):
+    '''
+    center and normal are [x, y, z] lists, color an RGB list,
+    return the CGO list of the ring.
+    '''
+    tail = [c - length * n for c, n in zip(center, normal)]
+    head = [c + length * n for c, n in zip(center, normal)]
+    return [COLOR] + color + [SPHERE] + center + [radius, CYLINDER] + tail + head + [0.06] + color + color
+
+
+# CGO of a ring pair: a dashed line between the two centers.
+def pair_cgo(coord1, coord2, color, dashes=8):
+    '''
+    coord1 and coord2 are [x, y, z] lists, color an RGB list,
+    return the CGO list of the pair.
+    '''
+    cgo = [BEGIN, LINES, COLOR] + color
+    for k in range(dashes):
+        for t in (float(2 * k) / (2 * dashes - 1), float(2 * k + 1) / (2 * dashes - 1)):
+            cgo += [VERTEX] + [a + t * (b - a) for a, b in zip(coord1, coord2)]
+    return cgo + [END]
 
 
 # Define the dialog for parameters
@@ -156,48 +141,132 @@ def setParamDialog(app):
     top = Tk()
     top.wm_title('PiViewer v1.2 for PyMOL')
     # Labels
-    L1 = Label(top, text="Ligand residue name")
+    L0 = Label(top, text="Objects or selections (empty: PDB files)")
+    L1 = Label(top, text="Ligand residue names")
     L2 = Label(top, text="Max ring centroid distance")
     L3 = Label(top, text="Max dihedral (parallel)")
     L4 = Label(top, text="Min dihedral (T-shaped)")
-    L1.grid(row=0, column=0, sticky=W)
-    L2.grid(row=1, column=0, sticky=W)
-    L3.grid(row=2, column=0, sticky=W)
-    L4.grid(row=3, column=0, sticky=W)
+    L5 = Label(top, text="State (0: all states)")
+    L0.grid(row=0, column=0, sticky=W)
+    L1.grid(row=1, column=0, sticky=W)
+    L2.grid(row=2, column=0, sticky=W)
+    L3.grid(row=3, column=0, sticky=W)
+    L4.grid(row=4, column=0, sticky=W)
+    L5.grid(row=5, column=0, sticky=W)
     # Text entries and default values
+    E0 = Entry(top, bd=5)
     E1 = Entry(top, bd=5)
     E2 = Entry(top, bd=5)
     E3 = Entry(top, bd=5)
     E4 = Entry(top, bd=5)
+    E5 = Entry(top, bd=5)
     # Modify the Default values here
     E1.insert(0, "LIG")
     E2.insert(0, "5.0")
     E3.insert(0, "25.0")
     E4.insert(0, "80.0")
-    E1.grid(row=0, column=1)
-    E2.grid(row=1, column=1)
-    E3.grid(row=2, column=1)
-    E4.grid(row=3, column=1)
+    E5.insert(0, "-1")
+    E0.grid(row=0, column=1)
+    E1.grid(row=1, column=1)
+    E2.grid(row=2, column=1)
+    E3.grid(row=3, column=1)
+    E4.grid(row=4, column=1)
+    E5.grid(row=5, column=1)
+
+    # Status of the runs
+    L6 = Label(top, text="Ready", anchor=W)
+    L6.grid(row=7, column=0, columnspan=2, sticky=W + E)
+    run = {'process': None, 'messages': None, 'found': 0}
+
+    # Back to the idle dialog once the jobs are over.
+    def finish(text):
+        L6.config(text='%s, %d Pi-Pi interactions found' % (text, run['found']))
+        run['process'] = None
+        B1.config(state=NORMAL)
+        B2.config(text="Close")
 
-    # When clicked, get the input and launch the main Pi-Pi viewer function - PiPi
+    # Poll the worker process from the Tk event loop and render the results in the GUI thread.
+    def poll():
+        if run['process'] is None:
+            return
+        alive = run['process'].is_alive()
+        try:
+            while True:
+                kind, value = run['messages'].get_nowait()
+                if kind == 'progress':
+                    L6.config(text=value)
+                elif kind == 'text':
+                    print value
+                elif kind == 'result':
+                    show_results(value[1], value[0])
+                    run['found'] += sum(found for _, found, _ in value[1])
+                elif kind == 'error':
+                    print value
+                else:
+                    run['process'].join()
+                    finish(value)
+                    return
+        except Queue.Empty:
+            pass
+        if not alive:
+            finish('Stopped (exit code %s)' % run['process'].exitcode)
+            return
+        top.after(100, poll)
+
+    # When clicked, get the input and launch the main Pi-Pi viewer function - PiPi - in the background
     def B1Click():
-        lig_name = E1.get()
+        lig_names = [name.strip() for name in E1.get().split(',') if name.strip()]
         centroid_distance = float(E2.get())
         dih_parallel = float(E3.get())
         dih_tshape = float(E4.get())
-        pdb_file = tkFileDialog.askopenfilename(
-            filetypes=[("PDB(Protein Data Bank files", "*.pdb"), ("PDB(Protein Data Bank files", "*.ent"),
-                       ('All files', '*')], title='Please select the target PDB file')
-        pdb_file = str(os.path.normpath(pdb_file))
-        print lig_name, centroid_distance, dih_parallel, dih_tshape
-        print pdb_file
-        PiPi(pdb_file, lig_name, centroid_distance, dih_parallel, dih_tshape)
-        top.destroy()
+        state = int(E5.get())
+        # The loaded objects or selections are used as they are, PDB files are asked for otherwise.
+        targets = [target.strip() for target in E0.get().split(',') if target.strip()]
+        if not targets:
+            pdb_files = tkFileDialog.askopenfilenames(
+                filetypes=[("PDB(Protein Data Bank files", "*.pdb"), ("PDB(Protein Data Bank files", "*.ent"),
+                           ('All files', '*')], title='Please select the target PDB files')
+            targets = [str(os.path.normpath(pdb_file)) for pdb_file in top.tk.splitlist(pdb_files)]
+        print lig_names, centroid_distance, dih_parallel, dih_tshape
+        print targets
+        # Queue one job per target and ligand, each drawn as its own object when there are several.
+        jobs = []
+        for target in targets:
+            states = target_states(target, state)
+            if not states:
+                print "No atoms in selection %s, please confirm." % target
+                continue
+            for lig_name in lig_names:
+                name = 'PiViewer'
+                if len(targets) * len(lig_names) > 1:
+                    name = re.sub(r'\W', '_', 'PiViewer_%s_%s' % (os.path.splitext(os.path.basename(target))[0],
+                                                                  lig_name))
+                jobs.append((target, lig_name, states, name))
+        if not jobs:
+            return
+        run['found'] = 0
+        run['messages'] = multiprocessing.Queue()
+        run['process'] = multiprocessing.Process(target=PiPi_jobs, args=(jobs, centroid_distance, dih_parallel,
+                                                                         dih_tshape, run['messages']))
+        run['process'].daemon = True
+        run['process'].start()
+        B1.config(state=DISABLED)
+        B2.config(text="Cancel")
+        top.after(100, poll)
+
+    # Cancel the running jobs at once, even inside OpenBabel, or close the dialog.
+    def B2Click():
+        if run['process'] is not None:
+            run['process'].terminate()
+            run['process'].join()
+            finish('Cancelled')
+        else:
+            top.destroy()
 
     B1 = Button(top, bd=2, pady=5, text="Run", command=B1Click)
-    B2 = Button(top, bd=2, pady=5, text="Cancel", command=top.destroy)
-    B1.grid(row=4, column=0, sticky=W + E)
-    B2.grid(row=4, column=1, sticky=W + E)
+    B2 = Button(top, bd=2, pady=5, text="Close", command=B2Click)
+    B1.grid(row=6, column=0, sticky=W + E)
+    B2.grid(row=6, column=1, sticky=W + E)
     top.mainloop()
 
 
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Pi-Pi search of the PiViewer PyMOL plugin, without PyMOL or Tkinter.
+The dialog runs it in a child process, which imports this module by name (with the spawn start method of Windows
+and macOS too), so it must stay free of the GUI imports: the rings and pairs found are returned as shapes that the
+plugin turns into CGO, and the report is handed to a callback instead of printed.
+"""
+
+import openbabel as ob
+import pybel
+import numpy as np
+import os
+
+
+# Define vecAngle for the degree between two vectors.
+def vecAngle(vec1, vec2):
+    '''
+    vec1,vec2 are ob.vector3 objects,
+    return the angle between them in degree.
+    '''
+    dotprod = vec1.GetX() * vec2.GetX() + vec1.GetY() * vec2.GetY() + vec1.GetZ() * vec2.GetZ()
+    deg = np.arccos(dotprod) * 180 / np.pi
+    if deg > 90:
+        deg = 180 - deg
+    return deg
+
+
+# Print a line of the report, in the process that runs the search.
+def echo(text):
+    print text
+
+
+# Report a stage of a run.
+def run_stage(stage, progress=None):
+    if progress is not None:
+        progress(stage)
+
+
+# Search every state, the PyMOL scene is not touched so that it can run in a worker process.
+def PiPi_run(states, lig_name, centroid_distance, dih_parallel, dih_tshape, progress=None, report=echo):
+    '''
+    states are (state, PDB file path or None, PDB string or None) as given by the plugin's target_states,
+    progress is called with the name of each stage and report with each line of the ring and pair report,
+    return a list of (state, number of Pi-Pi interactions found, shapes), see PiPi_state.
+    '''
+    results = []
+    for k, (state, pdb_file, pdb_string) in enumerate(states):
+        step = ' (state %d, %d of %d)' % (state, k + 1, len(states)) if len(states) > 1 else ''
+        stage = lambda name: run_stage(name + step, progress)
+        if len(states) > 1: report("State %d" % state)
+        stage('parse')
+        if pdb_file is not None:
+            mol = pybel.readfile('pdb', pdb_file).next()
+        else:
+            mol = pybel.readstring('pdb', pdb_string)
+        found, shapes = PiPi_state(mol, lig_name, centroid_distance, dih_parallel, dih_tshape, stage, report)
+        results.append((state, found, shapes))
+    return results
+
+
+# Run the jobs of the dialog one after the other, in a child process: OpenBabel holds the interpreter lock
+# while it parses and perceives rings, which would freeze PyMOL in a thread. Messages go to the GUI by messages.
+def PiPi_jobs(jobs, centroid_distance, dih_parallel, dih_tshape, messages):
+    report = lambda text: messages.put(('text', text))
+    for k, (target, lig_name, states, name) in enumerate(jobs):
+        prefix = 'Job %d of %d, %s %s: ' % (k + 1, len(jobs), os.path.basename(target), lig_name)
+        try:
+            results = PiPi_run(states, lig_name, centroid_distance, dih_parallel, dih_tshape,
+                               lambda stage: messages.put(('progress', prefix + stage)), report)
+        except Exception as e:
+            messages.put(('error', '%s%s: %s' % (prefix, type(e).__name__, e)))
+            continue
+        messages.put(('result', (name, results)))
+    messages.put(('end', 'Done'))
+
+
+# Find the Pi-Pi interactions of one state.
+def PiPi_state(mol, lig_name, centroid_distance, dih_parallel, dih_tshape, stage=run_stage, report=echo):
+    '''
+    mol is a pybel molecule, stage is called with the name of each stage and report with each line of the report,
+    return the number of Pi-Pi interactions found and the shapes drawing them: ('ring', center, normal, side)
+    with side 'ligand' or 'receptor', and ('pair', ligand center, receptor center, type) with type 'parallel'
+    or 'T-shaped', centers and normals being [x, y, z] lists.
+    '''
+    # Get ligand residue and print its name.
+    ligAtomList = []
+    ligAtomIdList = []
+    report("A total of %s residues" % mol.OBMol.NumResidues())
+    lig = None
+    for res in ob.OBResidueIter(mol.OBMol):
+        # print res.GetName()
+        if res.GetName() == lig_name:
+            lig = res
+            report("Ligand residue name is:  %s" % lig.GetName())
+            break
+    if not lig:
+        report("No ligand residue %s found, please confirm." % lig_name)
+        return 0, []
+    else:
+        for atom in ob.OBResidueAtomIter(lig):
+            # print atom.GetIdx()
+            ligAtomList.append(atom)
+            ligAtomIdList.append(atom.GetIdx())
+
+    # Set ring_id
+    stage('ring perception')
+    i = 0
+    for ring in mol.sssr:
+        ring.ring_id = i
+        i += 1
+        # print ring.ring_id
+
+    # Determine which rings are from ligand.
+    ligRingList = []
+    ligAroRingList = []
+    ligRingIdList = []
+    recRingList = []
+    recAroRingList = []
+    for ring in mol.sssr:
+        for atom in ligAtomList:
+            if ring.IsMember(atom):
+                if ring not in ligRingList:
+                    ligRingList.append(ring)
+                    ligRingIdList.append(ring.ring_id)
+                    if ring.IsAromatic():
+                        report("ligand ring_ID:  %s Aromatic" % ring.ring_id)
+                        ligAroRingList.append(ring)
+                    else:
+                        report("ligand ring_ID:  %s Saturated" % ring.ring_id)
+    for ring in mol.sssr:
+        if ring.ring_id not in ligRingIdList:
+            recRingList.append(ring)
+            if ring.IsAromatic():
+                recAroRingList.append(ring)
+    report("\nReceptor has  %s  rings,  has  %s  aromatic rings." % (len(recRingList), len(recAroRingList)))
+
+    # Find the pairs and the rings to draw
+    stage('pair search')
+    ligRingCenter = ob.vector3()
+    recRingCenter = ob.vector3()
+    ligNorm1 = ob.vector3()
+    ligNorm2 = ob.vector3()
+    recNorm1 = ob.vector3()
+    recNorm2 = ob.vector3()
+    shapes = []
+    recDrawn = []
+    count = 0
+    for ligRing in ligAroRingList:
+        stage('pair search')
+        ligRing.findCenterAndNormal(ligRingCenter, ligNorm1, ligNorm2)
+        coord1 = [ligRingCenter.GetX(), ligRingCenter.GetY(), ligRingCenter.GetZ()]
+        shapes.append(('ring', coord1, [ligNorm1.GetX(), ligNorm1.GetY(), ligNorm1.GetZ()], 'ligand'))
+        for recRing in recAroRingList:
+            recRing.findCenterAndNormal(recRingCenter, recNorm1, recNorm2)
+            dist = ligRingCenter.distSq(recRingCenter) ** 0.5
+            angle = vecAngle(ligNorm1, recNorm1)
+            if (dist < centroid_distance and (angle < dih_parallel or angle > dih_tshape)):  # the criteria
+                coord2 = [recRingCenter.GetX(), recRingCenter.GetY(), recRingCenter.GetZ()]
+                if recRing.ring_id not in recDrawn:
+                    recDrawn.append(recRing.ring_id)
+                    shapes.append(('ring', coord2, [recNorm1.GetX(), recNorm1.GetY(), recNorm1.GetZ()], 'receptor'))
+                shapes.append(('pair', coord1, coord2, 'parallel' if angle < dih_parallel else 'T-shaped'))
+                count += 1
+                report("Pi-Pi ring pairs: %3s,%3s  Angle(deg.): %5.2f  Distance(A): %.2f" % (recRing.ring_id, ligRing.ring_id, angle, dist))
+    return count, shapes
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Buffered writers of Pi-Pi interaction records for PiViewer batch runs.
+Records are tuples in the order of the writer columns, written in bulk to CSV, JSON Lines or Parquet
+(Parquet requires pyarrow).
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+
+
+class ResultWriter(object):
+    """
+    Base writer: records are buffered and flushed every buffer_size records and on close.
+    """
+
+    def __init__(self, path, columns, buffer_size=10000):
+        self.path = path
+        self.columns = list(columns)
+        self.buffer_size = buffer_size
+        self._buffer = []
+
+    def write(self, records):
+        '''
+        Append an iterable of records.
+        '''
+        self._buffer.extend(records)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._write(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, records):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+def _list_cell(value):
+    return ','.join(str(v) for v in value) if isinstance(value, (tuple, list)) else value
+
+
+class CsvWriter(ResultWriter):
+    """
+    CSV with a header line, tuples are written as comma separated strings.
+    """
+
+    def __init__(self, path, columns, buffer_size=10000):
+        ResultWriter.__init__(self, path, columns, buffer_size)
+        if sys.version_info[0] < 3:
+            self._file = open(path, 'wb')
+        else:
+            self._file = io.open(path, 'w', newline='')
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(self.columns)
+
+    def _write(self, records):
+        self._csv.writerows([[_list_cell(value) for value in record] for record in records])
+
+    def _close(self):
+        self._file.close()
+
+
+class JsonLinesWriter(ResultWriter):
+    """
+    One JSON object per line.
+    """
+
+    def __init__(self, path, columns, buffer_size=10000):
+        ResultWriter.__init__(self, path, columns, buffer_size)
+        self._file = open(path, 'w')
+
+    def _write(self, records):
+        self._file.write(''.join(json.dumps(dict(zip(self.columns, record))) + '\n' for record in records))
+
+    def _close(self):
+        self._file.close()
+
+
+class ParquetWriter(ResultWriter):
+    """
+    Parquet file, one row group per flushed buffer.
+    """
+
+    def __init__(self, path, columns, buffer_size=100000):
+        ResultWriter.__init__(self, path, columns, buffer_size)
+        import pyarrow
+        import pyarrow.parquet
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._writer = None
+
+    def _write(self, records):
+        table = self._pa.Table.from_arrays([self._pa.array([list(v) if isinstance(v, tuple) else v for v in column])
+                                            for column in zip(*records)], names=self.columns)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+WRITERS = {'.csv': CsvWriter, '.jsonl': JsonLinesWriter, '.parquet': ParquetWriter}
+
+
+def open_writer(path, columns, buffer_size=None):
+    '''
+    return the writer of path chosen by its extension (.csv, .jsonl or .parquet).
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in WRITERS:
+        raise ValueError('Unknown result file format: %s' % path)
+    if buffer_size is None:
+        return WRITERS[ext](path, columns)
+    return WRITERS[ext](path, columns, buffer_size)
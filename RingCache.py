@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of perceived rings for PiViewer.
+Rings are stored per structure file in .npz files keyed by the file content hash and the OpenBabel version,
+and the least recently used entries are evicted once the cache grows over its size limit.
+MemoryRingCache keeps them in memory instead, for long-lived processes.
+"""
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+# Bump when the stored arrays or the atom numbering change.
+CACHE_FORMAT = 1
+
+
+def _update_sha1(sha, path):
+    with open(path, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b''):
+            sha.update(chunk)
+
+
+def file_sha1(path):
+    '''
+    return the SHA-1 hex digest of the content of the file at path.
+    '''
+    sha = hashlib.sha1()
+    _update_sha1(sha, path)
+    return sha.hexdigest()
+
+
+class RingCache(object):
+    """
+    Directory of .npz ring files, bounded to max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._total = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, path, version):
+        '''
+        return the cache key of the file at path for the given OpenBabel version.
+        '''
+        sha = hashlib.sha1()
+        _update_sha1(sha, path)
+        sha.update(('|%s|%s' % (version, CACHE_FORMAT)).encode('ascii'))
+        return sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        '''
+        return a dict of the stored ring arrays, or None on a miss.
+        atoms is a list of atom index tuples, aromatic, centers, normals, resnames, chains and resnums are arrays.
+        '''
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                offsets = data['offsets']
+                flat = data['atoms'].tolist()
+                entry = dict((name, data[name]) for name in
+                             ('aromatic', 'centers', 'normals', 'resnames', 'chains', 'resnums'))
+            os.utime(path, None)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        entry['atoms'] = [tuple(flat[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+        return entry
+
+    def put(self, key, rings, resnames, chains, resnums):
+        '''
+        Store the RingSet rings with the residue name, chain and number of each ring, then evict old entries.
+        '''
+        offsets = np.cumsum([0] + [len(ring) for ring in rings.atoms])
+        flat = [i for ring in rings.atoms for i in ring]
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                np.savez(fout, atoms=np.array(flat, dtype=np.int32), offsets=offsets.astype(np.int32),
+                         aromatic=rings.aromatic, centers=rings.centers, normals=rings.normals,
+                         resnames=np.array(resnames, dtype=str), chains=np.array(chains, dtype=str),
+                         resnums=np.array(resnums, dtype=np.int32))
+            if os.name == 'nt' and os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+            os.rename(tmp, self._path(key))
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        # The directory is only rescanned once the running total goes over the limit.
+        if self._total is not None:
+            self._total += os.path.getsize(self._path(key))
+        if self._total is None or self._total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache fits in max_bytes.
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.npz'):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._total = total
+
+
+class MemoryRingCache(object):
+    """
+    In-memory ring cache bounded to max_entries files, with the interface of RingCache.
+    Files are keyed by their path, size and modification time rather than by their content.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def key(self, path, version):
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_size, st.st_mtime, version)
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, rings, resnames, chains, resnums):
+        self._entries[key] = {'atoms': rings.atoms, 'aromatic': rings.aromatic, 'centers': rings.centers,
+                              'normals': rings.normals, 'resnames': resnames, 'chains': chains, 'resnums': resnums}
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
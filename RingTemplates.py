@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Residue templates of the rings of standard amino acids and nucleotides for PiViewer.
+Ring atoms of these residues are taken from their atom names, so that OpenBabel only perceives the rings
+of the ligands and of the non-standard residues. The results are not those of OpenBabel: every HIS and TRP
+ring is aromatic here. Run as a script to compare the templates with OpenBabel on a set of structure files.
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+
+# Ring atom names in ring order and aromaticity of each ring of a residue.
+_PHENYL = [(('CG', 'CD1', 'CE1', 'CZ', 'CE2', 'CD2'), True)]
+_IMIDAZOLE = [(('CG', 'ND1', 'CE1', 'NE2', 'CD2'), True)]
+_PURINE = [(('N1', 'C2', 'N3', 'C4', 'C5', 'C6'), True), (('C4', 'C5', 'N7', 'C8', 'N9'), True)]
+_PYRIMIDINE = [(('N1', 'C2', 'N3', 'C4', 'C5', 'C6'), True)]
+
+TEMPLATES = {
+    'PHE': _PHENYL, 'TYR': _PHENYL,
+    'TRP': [(('CD2', 'CE2', 'CZ2', 'CH2', 'CZ3', 'CE3'), True), (('CG', 'CD1', 'NE1', 'CE2', 'CD2'), True)],
+    'HIS': _IMIDAZOLE, 'HID': _IMIDAZOLE, 'HIE': _IMIDAZOLE, 'HIP': _IMIDAZOLE, 'HSD': _IMIDAZOLE,
+    'HSE': _IMIDAZOLE, 'HSP': _IMIDAZOLE,
+    'PRO': [(('N', 'CA', 'CB', 'CG', 'CD'), False)],
+    'A': _PURINE, 'G': _PURINE, 'I': _PURINE, 'DA': _PURINE, 'DG': _PURINE, 'DI': _PURINE,
+    'C': _PYRIMIDINE, 'U': _PYRIMIDINE, 'T': _PYRIMIDINE, 'DC': _PYRIMIDINE, 'DT': _PYRIMIDINE, 'DU': _PYRIMIDINE,
+}
+
+# Standard residues fully described by TEMPLATES, the others have no ring.
+STANDARD_RESIDUES = frozenset(set(TEMPLATES) | set([
+    'ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'ILE', 'LEU', 'LYS', 'MET', 'SER', 'THR', 'VAL', 'CYX']))
+
+
+def standard_atoms(structure, atoms):
+    '''
+    structure is a PDBReader.Structure, atoms are atom indices,
+    return the boolean mask of the atoms belonging to standard residues.
+    '''
+    standard = np.array([structure.resnames[start] in STANDARD_RESIDUES for start in structure.res_starts[:-1]],
+                        dtype=bool)
+    return standard[structure.atom_res[atoms]]
+
+
+def template_ring_atoms(structure, residues):
+    '''
+    structure is a PDBReader.Structure, residues are residue indices,
+    return the list of ring atom index tuples in ring order and the list of their aromaticity.
+    Rings with a missing atom are skipped, the first of alternate locations is used.
+    '''
+    ring_atoms = []
+    aromatic = []
+    for res in residues:
+        start, end = structure.res_starts[res], structure.res_starts[res + 1]
+        templates = TEMPLATES.get(structure.resnames[start])
+        if not templates:
+            continue
+        index = {}
+        for i in range(start, end):
+            index.setdefault(structure.names[i], i)
+        for names, is_aromatic in templates:
+            if all(name in index for name in names):
+                ring_atoms.append(tuple(index[name] for name in names))
+                aromatic.append(is_aromatic)
+    return ring_atoms, aromatic
+
+
+def validate(pdb_file, lig_names=(), centroid_distance=5.0, dih_parallel=25, dih_tshape=80):
+    '''
+    Compare the template rings of the standard residues of pdb_file with the rings perceived by OpenBabel,
+    return a dict of the aromatic ring counts of both, the rings found by one only as Counters of residue names,
+    the max center distance and normal angle of the rings found by both,
+    and the numbers of Pi-Pi interactions of each of lig_names found with and without templates.
+    '''
+    if sys.version_info[0] < 3:
+        from PiViewer import file_rings, find_PiPi_multi
+    else:
+        from PiViewer_python3 import file_rings, find_PiPi_multi
+    import PDBReader
+
+    structure = PDBReader.read_structure(pdb_file)
+    isStandard = standard_atoms(structure, np.arange(len(structure.coords)))
+    obRings = file_rings(pdb_file, structure)
+    tplRings = file_rings(pdb_file, structure, templates=True)
+    ob = {}
+    for ring_atoms, is_aromatic, center, normal in zip(*obRings):
+        if is_aromatic and isStandard[list(ring_atoms)].all():
+            ob[frozenset(ring_atoms)] = (ring_atoms[0], center, normal)
+    tpl = {}
+    for ring_atoms, is_aromatic, center, normal in zip(*tplRings):
+        if is_aromatic and isStandard[ring_atoms[0]]:
+            tpl[frozenset(ring_atoms)] = (ring_atoms[0], center, normal)
+
+    both = [key for key in tpl if key in ob]
+    offsets = [np.linalg.norm(tpl[key][1] - ob[key][1]) for key in both]
+    angles = [np.degrees(np.arccos(min(1.0, abs(np.dot(tpl[key][2], ob[key][2]))))) for key in both]
+    counts = dict((lig_name, (ob_count, tpl_count)) for lig_name, ob_count, tpl_count in zip(
+        lig_names,
+        *[[results[name] for name in lig_names] for results in (
+            find_PiPi_multi(pdb_file, lig_names, centroid_distance, dih_parallel, dih_tshape, 0),
+            find_PiPi_multi(pdb_file, lig_names, centroid_distance, dih_parallel, dih_tshape, 0, templates=True))]))
+    return {'openbabel': len(ob), 'templates': len(tpl),
+            'openbabel_only': Counter(structure.resnames[ob[key][0]] for key in ob if key not in tpl),
+            'templates_only': Counter(structure.resnames[tpl[key][0]] for key in tpl if key not in ob),
+            'max_offset': max(offsets) if offsets else 0.0, 'max_angle': max(angles) if angles else 0.0,
+            'counts': counts}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the residue ring templates with OpenBabel, the exit status is 1 '
+                                                 'if a ring is aromatic for OpenBabel only or a ligand count differs.')
+    parser.add_argument('files', nargs='*', help='structure files in PDB or mmCIF format')
+    parser.add_argument('--list', default=None, help='list file of PDB codes and ligand residue names')
+    parser.add_argument('--structure-dir', default='.', help='directory holding the structure files of --list')
+    parser.add_argument('--suffix', default='_d1refined.pdb', help='file name suffix after the PDB code')
+    args = parser.parse_args(argv)
+    entries = [(path, []) for path in args.files]
+    if args.list:
+        from BatchAnalysis import parse_list_file
+        entries += [(os.path.join(args.structure_dir, pdb_code.lower() + args.suffix), lig_list)
+                    for pdb_code, lig_list in parse_list_file(args.list)]
+
+    obTotal = tplTotal = 0
+    obOnly = Counter()
+    tplOnly = Counter()
+    maxOffset = maxAngle = 0.0
+    ligands = differ = 0
+    for path, lig_list in entries:
+        result = validate(path, lig_list)
+        obTotal += result['openbabel']
+        tplTotal += result['templates']
+        obOnly.update(result['openbabel_only'])
+        tplOnly.update(result['templates_only'])
+        maxOffset = max(maxOffset, result['max_offset'])
+        maxAngle = max(maxAngle, result['max_angle'])
+        for lig_name, (ob_count, tpl_count) in sorted(result['counts'].items()):
+            ligands += 1
+            if ob_count != tpl_count:
+                differ += 1
+                print('%s\t%s\tOpenBabel: %d\tTemplates: %d' % (path, lig_name, ob_count, tpl_count))
+    print('Structures: %d' % len(entries))
+    print('Aromatic rings of standard residues, OpenBabel: %d  Templates: %d' % (obTotal, tplTotal))
+    print('Aromatic for OpenBabel only:', ', '.join('%s %d' % item for item in sorted(obOnly.items())) or '-')
+    print('Aromatic for templates only:', ', '.join('%s %d' % item for item in sorted(tplOnly.items())) or '-')
+    print('Max center distance (A): %.2e  Max normal angle (deg.): %.2e' % (maxOffset, maxAngle))
+    if ligands:
+        print('Ligands with different Pi-Pi counts: %d of %d' % (differ, ligands))
+    return 1 if obOnly or differ else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
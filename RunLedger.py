@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only ledger of batch runs for PiViewer.
+Every structure started, done or failed is appended as one JSON line keyed by the file content hash and the
+criteria, so that a restarted or extended run only analyzes new or changed structures, and files that
+repeatedly time out or crash their worker are quarantined instead of being retried forever.
+"""
+
+import json
+import os
+import time
+
+from RingCache import file_sha1
+
+
+def write_record(path, record):
+    '''
+    Append the record dict to the ledger at path in a single write, safe from several processes.
+    '''
+    line = (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+class RunLedger(object):
+    """
+    JSON lines ledger at path, read once when opened and appended to afterwards.
+    Workers append a 'started' record holding their pid, the batch then appends 'done', 'error', 'timeout' or
+    'crashed' (the worker running the file died). A file is quarantined once max_attempts of its runs with the
+    same criteria timed out or crashed. Started records left alone by a batch that was itself killed are not
+    held against the files.
+    """
+
+    def __init__(self, path, max_attempts=2):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._results = {}
+        self._failures = {}
+        self._digests = {}
+        if os.path.exists(path):
+            with open(path, 'r') as fin:
+                for line in fin:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line of a run killed while writing.
+                        continue
+                    self._load(record)
+
+    def _load(self, record):
+        key = (record['sha1'], record['criteria'])
+        status = record['status']
+        if status == 'done':
+            self._results.setdefault(key, {}).update(record['results'])
+            self._digests[record['file']] = (record['size'], record['mtime'], record['sha1'])
+        elif status == 'timeout' or status == 'crashed':
+            self._failures[key] = self._failures.get(key, 0) + 1
+
+    def digest(self, path):
+        '''
+        return the SHA-1 of the file at path, taken from the ledger if its size and modification time are unchanged.
+        '''
+        st = os.stat(path)
+        known = self._digests.get(path)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime:
+            return known[2]
+        sha1 = file_sha1(path)
+        self._digests[path] = (st.st_size, st.st_mtime, sha1)
+        return sha1
+
+    def results(self, sha1, criteria, lig_names):
+        '''
+        return the dict of the recorded results of each of lig_names, None unless all of them are recorded.
+        '''
+        recorded = self._results.get((sha1, criteria), {})
+        if not all(lig_name in recorded for lig_name in lig_names):
+            return None
+        return dict((lig_name, recorded[lig_name]) for lig_name in lig_names)
+
+    def quarantined(self, sha1, criteria):
+        return self._failures.get((sha1, criteria), 0) >= self.max_attempts
+
+    def record(self, status, sha1, criteria, pdb_code, pdb_file, results=None, error=None):
+        '''
+        return a record of the given status, results is the dict of ligand name to result of a 'done' record.
+        '''
+        record = {'status': status, 'sha1': sha1, 'criteria': criteria, 'pdb_code': pdb_code, 'file': pdb_file,
+                  'time': time.time()}
+        if status == 'done':
+            size, mtime, _ = self._digests.get(pdb_file) or (os.path.getsize(pdb_file),
+                                                             os.path.getmtime(pdb_file), sha1)
+            record.update(results=results, size=size, mtime=mtime)
+        if error is not None:
+            record['error'] = error
+        return record
+
+    def append(self, status, sha1, criteria, pdb_code, pdb_file, results=None, error=None):
+        '''
+        Append a record of the given status, see record.
+        '''
+        record = self.record(status, sha1, criteria, pdb_code, pdb_file, results, error)
+        write_record(self.path, record)
+        self._load(record)
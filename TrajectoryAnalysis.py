@@ -0,0 +1,102 @@
+from __future__ import print_function
+import argparse
+import sys
+
+import numpy as np
+
+if sys.version_info[0] < 3:
+    from PiViewer import file_rings, ring_geometry, pair_geometry, pipi_mask
+else:
+    from PiViewer_python3 import file_rings, ring_geometry, pair_geometry, pipi_mask
+import PDBReader
+
+
+def iter_frames(topology_file, trajectory=None):
+    '''
+    return a generator of the (N,3) coordinates of each frame: the MODELs of the topology PDB file,
+    or the frames of a DCD/XTC/... trajectory read with MDAnalysis (optional dependency).
+    '''
+    if trajectory is None:
+        with PDBReader.open_text(topology_file) as fin:
+            for coords in PDBReader.iter_pdb_frames(fin):
+                yield coords
+        return
+    import MDAnalysis
+    universe = MDAnalysis.Universe(topology_file, trajectory)
+    for _ in universe.trajectory:
+        yield universe.atoms.positions.astype(float)
+
+
+def trajectory_PiPi(topology_file, lig_name, trajectory=None, centroid_distance=5.0, dih_parallel=25, dih_tshape=80,
+                    templates=False):
+    """
+    Pi-Pi interaction occupancy of the ligand residue over the frames of an ensemble or trajectory.
+    Rings and aromaticity are perceived once on the first frame, later frames only move the ring atoms.
+    :param topology_file: PDB file, its MODELs are the frames unless a trajectory is given.
+    :param lig_name: ligand residue name.
+    :param trajectory: optional trajectory file with the atoms of topology_file in the same order.
+    :param centroid_distance: Max ring centroid distance
+    :param dih_parallel: Max dihedral (parallel)
+    :param dih_tshape: Min dihedral (T-shaped)
+    :param templates: take the rings of standard residues from RingTemplates instead of OpenBabel.
+    :return: (number of frames, list of (lig_ring_id, rec_ring_id, resname, chain, resnum, frames found, occupancy)),
+             None if the ligand is not found
+    """
+    structure = PDBReader.read_structure(topology_file)
+    if lig_name not in structure.res_index:
+        return None
+    ligAtomIdSet = set(PDBReader.residue_atoms(structure, structure.res_index[lig_name][0]).tolist())
+    rings = file_rings(topology_file, structure, templates=templates)
+    isLigRing = np.array([not ligAtomIdSet.isdisjoint(ring) for ring in rings.atoms], dtype=bool)
+    ligAroRingIds = np.nonzero(isLigRing & rings.aromatic)[0]
+    recAroRingIds = np.nonzero(~isLigRing & rings.aromatic)[0]
+    ligRingAtoms = [rings.atoms[i] for i in ligAroRingIds]
+    recRingAtoms = [rings.atoms[i] for i in recAroRingIds]
+
+    hits = np.zeros((len(ligAroRingIds), len(recAroRingIds)), dtype=int)
+    frames = 0
+    for coords in iter_frames(topology_file, trajectory):
+        if len(coords) != len(structure.coords):
+            raise ValueError('Frame %d has %d atoms, expected %d' % (frames + 1, len(coords), len(structure.coords)))
+        ligCenters, ligNormals = ring_geometry(coords, ligRingAtoms)
+        recCenters, recNormals = ring_geometry(coords, recRingAtoms)
+        dist, angle = pair_geometry(ligCenters, ligNormals, recCenters, recNormals)
+        hits += pipi_mask(dist, angle, centroid_distance, dih_parallel, dih_tshape)
+        frames += 1
+
+    interactions = []
+    for i, j in zip(*np.nonzero(hits)):
+        first = structure.res_starts[structure.atom_res[recRingAtoms[j][0]]]
+        interactions.append((int(ligAroRingIds[i]), int(recAroRingIds[j]), structure.resnames[first],
+                             structure.chains[first], int(structure.resnums[first]), int(hits[i, j]),
+                             float(hits[i, j]) / frames))
+    return frames, interactions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pi-Pi interaction occupancy over an ensemble or trajectory.')
+    parser.add_argument('topology', help='PDB file, each MODEL is a frame unless a trajectory is given')
+    parser.add_argument('ligand', help='ligand residue name')
+    parser.add_argument('--trajectory', default=None, help='DCD/XTC/... trajectory file, requires MDAnalysis')
+    parser.add_argument('--centroid-distance', type=float, default=5.0, help='Max ring centroid distance')
+    parser.add_argument('--dih-parallel', type=float, default=25, help='Max dihedral (parallel)')
+    parser.add_argument('--dih-tshape', type=float, default=80, help='Min dihedral (T-shaped)')
+    parser.add_argument('--templates', action='store_true',
+                        help='take the rings of standard residues from atom name templates, faster but not '
+                             'equivalent to OpenBabel (all HIS and TRP rings are aromatic)')
+    args = parser.parse_args(argv)
+
+    result = trajectory_PiPi(args.topology, args.ligand, args.trajectory, args.centroid_distance, args.dih_parallel,
+                             args.dih_tshape, args.templates)
+    if result is None:
+        print("No ligand residue %s found, please confirm." % args.ligand)
+        return 1
+    frames, interactions = result
+    print("Frames:", frames)
+    for lig_ring, rec_ring, resname, chain, resnum, found, occupancy in interactions:
+        print("Pi-Pi ring pairs: %3s,%3s  %s %s%s  Frames: %d  Occupancy: %.3f" % (
+            rec_ring, lig_ring, resname, chain, resnum, found, occupancy))
+
+
+if __name__ == '__main__':
+    sys.exit(main())